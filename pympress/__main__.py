@@ -29,6 +29,7 @@ from __future__ import print_function, unicode_literals
 import logging
 import os
 import sys
+import time
 import getopt
 import signal
 import locale
@@ -40,6 +41,9 @@ from pympress import util
 import faulthandler
 faulthandler.enable(True)
 
+#: Time at which pympress started, for profiling the start up
+_start_time = time.perf_counter()
+
 # Setup logging, and catch all uncaught exceptions in the log file.
 # Load pympress.util early (OS and path-specific things) to load and setup gettext translation asap.
 logger = logging.getLogger(__name__)
@@ -100,7 +104,7 @@ except ModuleNotFoundError:
 
 
 # Finally the real deal: load pympress modules, handle command line args, and start up
-from pympress import extras, document, ui
+from pympress import document, ui
 
 
 def usage():
@@ -121,6 +125,18 @@ def usage():
     -o section:key=value, --option   {config_option}
     --log=level                      {log_level}
                                          {log_levels_list}
+    --profile-startup                {profile_startup}
+
+{export_options}
+
+    -e dir, --export=dir             {export}
+    --pages=1-5,8                    {pages}
+    --size=width[xheight]            {size}
+    --format=png|webp                {format}
+    --page-type=type                 {page_type}
+                                         {page_types}
+    --no-scribbles                   {no_scribbles}
+    -j n, --jobs=n                   {jobs}
 '''.format(
         usage           = _('Usage: {} [options] <presentation_file>').format(sys.argv[0]),
         options         = _('Options:'),
@@ -135,6 +151,16 @@ def usage():
         config_option   = _('Overrides config file option.'),
         log_level       = _('Set level of verbosity in log file:'),
         log_levels_list = _('{}, {}, {}, {}, or {}').format('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'),
+        profile_startup = _('Print where start up time goes, once the first slide is shown'),
+        export_options  = _('Batch export (no window is opened):'),
+        export          = _('Render pages of the presentation as images in dir'),
+        pages           = _('Pages to export, numbered from 1 (default: all)'),
+        size            = _('Maximum size of the images in pixels (default: 1024)'),
+        format          = _('Format of the images (default: png)'),
+        page_type       = _('Part of the pdf pages to export'),
+        page_types      = _('(full, left, right, top, or bottom; default: full)'),
+        no_scribbles    = _('Do not draw the saved scribbles'),
+        jobs            = _('Number of processes rendering pages (default: number of cores)'),
     ))
 
 
@@ -142,8 +168,10 @@ def parse_opts(opts):
     """ Parse command line options, returned from getopt.getopt().
 
     Returns:
-        `tuple`: estimated talk time, log level, notes positions.
+        `tuple`: estimated talk time, log level, notes positions, highlight mode, config overrides, debug flag,
+        and `dict` of batch export options (empty if not exporting).
     """
+    export = {}
     ett = 0
     log_level = logging.ERROR
     notes_pos = None
@@ -192,6 +220,38 @@ def parse_opts(opts):
                 print(_("Invalid log level \"{}\", try one of {}").format(
                     arg, "DEBUG, INFO, WARNING, ERROR, CRITICAL"
                 ))
+        elif opt in ("-e", "--export"):
+            export['out_dir'] = arg
+        elif opt == "--pages":
+            export['pages'] = arg
+        elif opt == "--size":
+            try:
+                export['size'] = tuple(int(n) for n in (arg.lower().split('x') + ['0'])[:2])
+            except ValueError:
+                print(_("Invalid size (width or widthxheight expected), got \"{}\"").format(arg))
+                usage()
+                sys.exit(2)
+        elif opt == "--format":
+            export['fmt'] = arg.lower()
+        elif opt == "--page-type":
+            types = {'f': document.PdfPage.FULL, 'l': document.PdfPage.LEFT, 'r': document.PdfPage.RIGHT,
+                     't': document.PdfPage.TOP, 'b': document.PdfPage.BOTTOM}
+            if arg.lower()[:1] not in types:
+                print(_("Invalid page type (full, left, right, top, or bottom expected), got \"{}\"").format(arg))
+                usage()
+                sys.exit(2)
+            export['dtype'] = types[arg.lower()[:1]]
+        elif opt == "--no-scribbles":
+            export['with_scribbles'] = False
+        elif opt in ("-j", "--jobs"):
+            try:
+                export['jobs'] = int(arg)
+                if export['jobs'] < 1:
+                    raise ValueError
+            except ValueError:
+                print(_("Invalid number of processes (positive integer expected), got \"{}\"").format(arg))
+                usage()
+                sys.exit(2)
         elif opt in ("-o", "--option"):
             sect, rest = arg.split(':', 1)
             key, value = rest.split('=', 1)
@@ -200,7 +260,7 @@ def parse_opts(opts):
             else:
                 config_override[sect] = {key: value}
 
-    return ett, log_level, notes_pos, highlight_mode, config_override, debug
+    return ett, log_level, notes_pos, highlight_mode, config_override, debug, export
 
 
 def main(argv = sys.argv[1:]):
@@ -208,11 +268,47 @@ def main(argv = sys.argv[1:]):
     """
     signal.signal(signal.SIGINT, signal.SIG_DFL)
 
+    try:
+        opts, args = getopt.getopt(argv, "dhm:n:o:t:e:j:",
+                                   ["debug", "help", "highlight-mode=", "notes=", "talk-time=", "log=", "option",
+                                    "export=", "pages=", "size=", "format=", "page-type=", "no-scribbles", "jobs=",
+                                    "profile-startup"])
+        opts = dict(opts)
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    ett, log_level, notes_pos, highlight_mode, config_override, debug, export = parse_opts(opts)
+    if debug:
+        logging.basicConfig(level=logging.DEBUG,
+            format='%(asctime)s %(levelname)s - %(message)s')
+    else:
+        logging.basicConfig(filename=util.get_log_path())
+        logger.setLevel(log_level)
+
+    if 'out_dir' in export:
+        # Batch mode: does not need a display, so do this before initializing Gtk
+        if not args:
+            usage()
+            sys.exit(2)
+        from pympress import batch
+        try:
+            failed = batch.export_pages(args[0], config_override=config_override, **export)
+        except ValueError as e:
+            print(e)
+            usage()
+            sys.exit(2)
+        sys.exit(1 if failed else 0)
+
+    if '--profile-startup' in opts:
+        util.StartupProfiler.start(_start_time)
+
     # prefere X11 on posix systems because Wayland still has some shortcomings for us,
     # specifically libVLC and the ability to disable screensavers
     if util.IS_POSIX:
         Gdk.set_allowed_backends('x11,*')
     Gtk.init(argv)
+    util.StartupProfiler.mark('Gtk initialized')
 
     pympress_meta = util.get_pympress_meta()['version']
     logger.info(' '.join([
@@ -223,27 +319,11 @@ def main(argv = sys.argv[1:]):
         '; GLib {}.{}.{}'.format(GLib.MAJOR_VERSION, GLib.MINOR_VERSION, GLib.MICRO_VERSION),
         '; Poppler', document.Poppler.get_version(), document.Poppler.get_backend().value_nick,
         '; Cairo', cairo.cairo_version_string(), ', pycairo', cairo.version,
-        '; Media:', extras.Media.backend_version()
     ]))
 
-    try:
-        opts, args = getopt.getopt(argv, "dhm:n:o:t:",
-                                   ["debug", "help", "highlight-mode=", "notes=", "talk-time=", "log=", "option"])
-        opts = dict(opts)
-    except getopt.GetoptError:
-        usage()
-        sys.exit(2)
-
-    ett, log_level, notes_pos, highlight_mode, config_override, debug = parse_opts(opts)
-    if debug:
-        logging.basicConfig(level=logging.DEBUG,
-            format='%(asctime)s %(levelname)s - %(message)s')
-    else:
-        logging.basicConfig(filename=util.get_log_path())
-        logger.setLevel(log_level)
-
     # Create windows
     gui = ui.UI(highlight_mode, config_override)
+    util.StartupProfiler.mark('windows created')
 
     # Connect proper exit function to interrupt
     signal.signal(signal.SIGINT, gui.save_and_quit)
@@ -253,10 +333,14 @@ def main(argv = sys.argv[1:]):
         gui.est_time.set_time(ett)
 
     gui.swap_document(os.path.abspath(args[0])) if args else gui.pick_file()
+    util.StartupProfiler.mark('document opened')
 
     if notes_pos is not None:
         gui.change_notes_pos(notes_pos, force_change = True)
 
+    if util.StartupProfiler.marks is not None:
+        gui.c_da.connect_after('draw', lambda *args: util.StartupProfiler.report())
+
     gui.run()
 
 
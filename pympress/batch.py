@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+#
+#       batch.py
+"""
+:mod:`pympress.batch` -- Render slides to image files from the command line, in parallel
+----------------------------------------------------------------------------------------
+"""
+import os
+import json
+import gettext
+import multiprocessing
+import concurrent.futures
+
+import logging
+logger = logging.getLogger(__name__)
+
+import cairo
+import gi
+gi.require_version('Poppler', '0.18')
+gi.require_version('Gdk', '3.0')
+from gi.repository import Poppler, Gdk, GLib
+
+from pympress import util, document
+
+
+#: Formats in which pages can be exported
+FORMATS = ('png', 'webp')
+
+#: State of a worker process: the opened document and the scribble renderer
+worker = {}
+
+
+def parse_pages(spec, nb_pages):
+    """ Parse a selection of pages such as ``1-5,8,10-``, numbered from 1
+
+    Args:
+        spec (`str`): the selection, or `None` for all pages
+        nb_pages (`int`): the number of pages in the document
+
+    Returns:
+        `list` of `int`: the selected page numbers, starting from 0
+
+    Raises:
+        ValueError: if the selection is malformed or selects no page
+    """
+    if not spec:
+        return list(range(nb_pages))
+
+    pages, selected = [], set()
+    for part in spec.split(','):
+        first, sep, last = part.strip().partition('-')
+        try:
+            first = int(first) if first else 1
+            last = (int(last) if last else nb_pages) if sep else first
+        except ValueError:
+            raise ValueError(_('Invalid page selection (e.g. 1-5,8 expected), got "{}"').format(spec))
+        for p in range(max(first, 1) - 1, min(last, nb_pages)):
+            if p not in selected:
+                selected.add(p)
+                pages.append(p)
+
+    if not pages:
+        raise ValueError(_('No page selected by "{}", the document has {} pages').format(spec, nb_pages))
+    return pages
+
+
+def read_sidecar(path, nb_pdf_pages, with_scribbles):
+    """ Read the page map and scribbles saved next to a document, as json-loaded data
+
+    Args:
+        path (`str`): the path to the pdf
+        nb_pdf_pages (`int`): the number of pages in the pdf
+        with_scribbles (`bool`): whether to read the scribbles as well
+
+    Returns:
+        `tuple`: the `dict` mapping page numbers to pdf pages (-1 for inserted pages), and the `dict` of scribbles
+    """
+    page_map, scribbles = {}, {}
+    try:
+        with open(path + '.pymp', 'r') as f:
+            in_dict = json.load(f)
+        page_map = {int(key): val for key, val in in_dict.get('page_map', {}).items() if val < nb_pdf_pages}
+        if with_scribbles:
+            scribbles = {int(key.split('.')[0]): val for key, val in in_dict.get('scribbles', {}).items()}
+    except (OSError, ValueError):
+        pass
+
+    # Pages not in the saved map go at the end, as when opening the document
+    mapped = set(page_map.values())
+    for p in range(nb_pdf_pages):
+        if p not in mapped:
+            page_map[len(page_map)] = p
+
+    return page_map, scribbles
+
+
+def init_worker(path, config_override):
+    """ Open the document once in each worker process
+
+    Args:
+        path (`str`): the path to the pdf
+        config_override (`dict`): the options overridden on the command line, as for the parent process
+    """
+    gettext.install('pympress', util.get_locale_dir())
+    from pympress import config, scribble
+
+    conf = config.Config()
+    conf.read_dict(config_override)
+
+    worker['doc'] = Poppler.Document.new_from_file(document.Document.path_to_uri(path), None)
+    worker['scribbler'] = scribble.Scribbler.offscreen(conf)
+
+
+def render_page(task):
+    """ Render a page, with its scribbles, to an image file. Runs in a worker process.
+
+    Args:
+        task (`tuple`): the pdf page number (-1 for a blank page), json-loaded scribbles, page type as `int`,
+                        maximum width and height, image format and output file name
+
+    Returns:
+        `str`: the output file name
+    """
+    pdf_page, scribbles, dtype, max_w, max_h, fmt, filename = task
+    dtype = document.PdfPage(dtype)
+
+    page = worker['doc'].get_page(max(0, pdf_page))
+    pw, ph = dtype.scale().from_screen(*page.get_size())
+    scale = min(max_w / pw if max_w else float('inf'), max_h / ph if max_h else float('inf'))
+    if scale == float('inf'):
+        scale = 1
+    ww, wh = max(1, round(pw * scale)), max(1, round(ph * scale))
+
+    surface = cairo.ImageSurface(cairo.FORMAT_RGB24, ww, wh)
+    cr = cairo.Context(surface)
+    cr.set_source_rgb(1, 1, 1)
+    cr.paint()
+
+    if pdf_page >= 0:
+        cr.save()
+        cr.scale(scale, scale)
+        if dtype == document.PdfPage.RIGHT:
+            cr.translate(-pw, 0)
+        elif dtype == document.PdfPage.BOTTOM:
+            cr.translate(0, -ph)
+        page.render(cr)
+        cr.restore()
+
+    if scribbles:
+        # Scribbles scale with the width of the full pdf page, as on screen
+        worker['scribbler'].render_scribbles(cr, document.decode_scribbles(scribbles), ww, wh, page.get_size()[0])
+
+    surface.flush()
+    if fmt == 'png':
+        surface.write_to_png(filename)
+    else:
+        Gdk.pixbuf_get_from_surface(surface, 0, 0, ww, wh).savev(filename, fmt, [], [])
+    return filename
+
+
+def export_pages(path, out_dir, pages=None, size=(1024, 0), fmt='png', dtype=document.PdfPage.FULL,
+                 with_scribbles=True, jobs=None, config_override={}):
+    """ Render pages of a document to image files, using a pool of processes
+
+    Args:
+        path (`str`): the path to the pdf
+        out_dir (`str`): the directory where the images are written
+        pages (`str`): the selection of pages, numbered from 1, e.g. ``1-5,8``, or `None` for all pages
+        size (`tuple`): the maximum width and height of the images, 0 for no limit
+        fmt (`str`): the image format, one of :data:`FORMATS`
+        dtype (:class:`~pympress.document.PdfPage`): the part of the pdf pages to render
+        with_scribbles (`bool`): whether to draw the scribbles saved next to the document
+        jobs (`int`): the number of processes, by default the number of cores
+        config_override (`dict`): the options overridden on the command line, applied in the worker processes
+
+    Returns:
+        `int`: the number of pages that could not be exported
+
+    Raises:
+        ValueError: if the format or page selection is invalid, or the document can not be opened
+    """
+    path = os.path.abspath(path)
+    if fmt not in FORMATS:
+        raise ValueError('Unsupported export format {}'.format(fmt))
+
+    try:
+        pdf = Poppler.Document.new_from_file(document.Document.path_to_uri(path), None)
+    except GLib.Error as e:
+        raise ValueError(_('Error opening the file "{}"').format(path) + ': ' + e.message)
+    page_map, scribbles = read_sidecar(path, pdf.get_n_pages(), with_scribbles)
+    del pdf
+
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    digits = len(str(len(page_map)))
+
+    tasks = [(page_map[p], scribbles.get(p), int(dtype), size[0], size[1], fmt,
+              os.path.join(out_dir, '{}-{:0{}d}.{}'.format(stem, p + 1, digits, fmt)))
+             for p in parse_pages(pages, len(page_map))]
+
+    # Poppler and GObject do not survive a fork, start fresh processes
+    context = multiprocessing.get_context('spawn')
+    failed = 0
+    with concurrent.futures.ProcessPoolExecutor(jobs, mp_context=context,
+                                                initializer=init_worker, initargs=(path, config_override)) as pool:
+        futures = {pool.submit(render_page, task): task for task in tasks}
+        for n, future in enumerate(concurrent.futures.as_completed(futures)):
+            try:
+                logger.info('Exported {} ({}/{})'.format(future.result(), n + 1, len(tasks)))
+            except Exception as e:
+                failed += 1
+                logger.error('Failed to export {}: {}'.format(futures[future][-1], e))
+
+    return failed
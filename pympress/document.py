@@ -42,12 +42,15 @@ import os
 import math
 import enum
 import json
+import gzip
 import base64
 import tempfile
+import threading
 import mimetypes
 import webbrowser
 from xml.sax.saxutils import escape as xml_escape
 
+import cairo
 import gi
 gi.require_version('Poppler', '0.18')
 from gi.repository import Poppler, Gdk, GdkPixbuf, GLib
@@ -608,23 +611,57 @@ class Page(object):
         """
         return True
 
-def xopp_box_ellipse(s, page, f):
-    pen = "pen" if s[5][3] == 1 else "highlighter"
+def xopp_box_ellipse(s, pw, ph):
+    """ Get the points of the outline of a box or ellipse scribble, in xournal++ format
+
+    Ellipses are tessellated finely enough that chords stray less than a tenth of a point from the curve.
+
+    Args:
+        s (`list`): the box or ellipse scribble
+        pw (`float`): the width of the page in points
+        ph (`float`): the height of the page in points
+
+    Returns:
+        `str`: the points and closing tag of the stroke
+    """
     if s[0] == "box":
-        print("    ", s[3][0][0]*page.pw, s[3][0][1]*page.ph, file=f)
-        print("    ", s[3][1][0]*page.pw, s[3][0][1]*page.ph, file=f)
-        print("    ", s[3][1][0]*page.pw, s[3][1][1]*page.ph, file=f)
-        print("    ", s[3][0][0]*page.pw, s[3][1][1]*page.ph, file=f)
-        print("    ", s[3][0][0]*page.pw, s[3][0][1]*page.ph, file=f)
-    elif s[0] == "ellipse":
-        steps = 720
-        ry = (s[3][1][1]-s[3][0][1]) * page.ph / 2
-        rx = (s[3][1][0]-s[3][0][0]) * page.pw / 2
-        cy = (s[3][1][1]+s[3][0][1]) * page.ph / 2
-        cx = (s[3][1][0]+s[3][0][0]) * page.pw / 2
-        for i in range(steps):
-            print("    ", cx + math.cos(i/steps * math.pi * 2) * rx, cy + math.sin(i/steps * math.pi * 2) * ry, file=f)
-    print("</stroke>", file=f)
+        x0, y0, x1, y1 = s[3][0][0]*pw, s[3][0][1]*ph, s[3][1][0]*pw, s[3][1][1]*ph
+        points = [(x0, y0), (x1, y0), (x1, y1), (x0, y1), (x0, y0)]
+    else:
+        ry = (s[3][1][1]-s[3][0][1]) * ph / 2
+        rx = (s[3][1][0]-s[3][0][0]) * pw / 2
+        cy = (s[3][1][1]+s[3][0][1]) * ph / 2
+        cx = (s[3][1][0]+s[3][0][0]) * pw / 2
+        r = max(abs(rx), abs(ry), 0.1)
+        steps = min(720, max(16, math.ceil(math.pi / math.acos(max(-1, 1 - 0.1 / r)))))
+        points = [(cx + math.cos(i/steps * math.pi * 2) * rx, cy + math.sin(i/steps * math.pi * 2) * ry)
+                  for i in range(steps)]
+    return ''.join('     {} {}\n'.format(x, y) for x, y in points) + '</stroke>\n'
+
+def decode_scribbles(scribble_list):
+    """ Restore scribbles as they were saved in json, in place
+
+    Args:
+        scribble_list (`list`): the scribbles of a page, as loaded from json
+
+    Returns:
+        `list`: the scribbles, usable for drawing
+    """
+    for scribble in scribble_list:
+        if 'rgba' in scribble[1]:
+            scribble[1] = tuple(scribble[1]['rgba'])
+        if scribble[0] in ['box', 'ellipse'] and len(scribble) > 5 and 'rgba' in scribble[5]:
+            scribble[5] = tuple(scribble[5]['rgba'])
+        if scribble[0] in ['text', 'latex']:
+            scribble[4] = [[0,0], [0,0]]
+        if scribble[0] in ['image', 'latex']:
+            pp = 5 if scribble[0] == 'image' else 6
+            try:
+                data = GLib.Bytes(base64.b64decode(scribble[pp]['pixels']))
+                scribble[pp] = GdkPixbuf.Pixbuf.new_from_bytes(data, *scribble[pp]['params'])
+            except:
+                scribble[pp] = None
+    return scribble_list
 
 class Document(object):
     """ This is the main document handling class.
@@ -704,22 +741,7 @@ class Document(object):
                 if self.highlight_mode == "autopage" and 'scribbles' in in_dict:
                     scribbles = in_dict['scribbles']
                     for key, scribble_list in scribbles.items():
-                        self.scribbles[int(key.split('.')[0])] = []
-                        for scribble in scribble_list:
-                            if 'rgba' in scribble[1]:
-                                scribble[1] = tuple(scribble[1]['rgba'])
-                            if scribble[0] in ['box', 'ellipse'] and len(scribble) > 5 and 'rgba' in scribble[5]:
-                                scribble[5] = tuple(scribble[5]['rgba'])
-                            if scribble[0] in ['text', 'latex']:
-                                scribble[4] = [[0,0], [0,0]]
-                            if scribble[0] in ['image', 'latex']:
-                                pp = 5 if scribble[0] == 'image' else 6
-                                try:
-                                    data = GLib.Bytes(base64.b64decode(scribble[pp]['pixels']))
-                                    scribble[pp] = GdkPixbuf.Pixbuf.new_from_bytes(data, *scribble[pp]['params'])
-                                except:
-                                    scribble[pp] = None
-                        self.scribbles[int(key.split('.')[0])] = scribble_list
+                        self.scribbles[int(key.split('.')[0])] = decode_scribbles(scribble_list)
             except OSError:
                 pass
             except json.decoder.JSONDecodeError:
@@ -792,78 +814,179 @@ class Document(object):
             f = open(path + '.pymp', "w")
             json.dump(out_dict, f, cls=RGBAEncoder)
 
-    def export_pdf(self, filename=None):
+    def export_pdf(self, filename=None, progress=None, done=None):
+        """ Export the pdf with its scribbles, rendering one page per main loop iteration
+
+        Pages are written out as soon as they are rendered, so that only one is held in memory. LaTeX scribbles that
+        are not compiled yet are compiled in the background first.
+
+        Args:
+            filename (`str`): the path of the exported file, by default next to the document
+            progress (`function`): called with the exported fraction of the document
+            done (`function`): called with the exception that stopped the export, or `None`
+        """
         if filename is None:
             filename = self.path + '.pdf'
-        with tempfile.NamedTemporaryFile('w') as f:
-            name = f.name
-            self.export_xopp(f=f)
-            f.flush()
-            os.system(f"xournalpp -p {filename} {name}")
-
-    def export_xopp(self, filename=None, f=None):
-        """ Export modified pdf to xournal++
+
+        if not self.nb_pages:
+            logger.error('Export failed: no pages to export')
+            if done is not None:
+                done(ValueError('No pages to export'))
+            return
+
+        def export_pages():
+            error = None
+            try:
+                page = self.page(0)
+                surface = cairo.PDFSurface(filename, page.pw, page.ph)
+                for p in range(self.nb_pages):
+                    page = self.page(p)
+                    surface.set_size(page.pw, page.ph)
+                    cr = cairo.Context(surface)
+                    cr.save()
+                    page.render_cairo(cr, page.pw, page.ph)
+                    cr.restore()
+                    self.scribbler.render_scribbles(cr, list(self.scribbles.get(p, [])), page.pw, page.ph, page.pw)
+                    surface.show_page()
+                    if progress is not None:
+                        progress((p + 1) / self.nb_pages)
+                    yield True
+                surface.finish()
+            except Exception as e:
+                logger.error('Export failed: {}'.format(e))
+                error = e
+            if done is not None:
+                done(error)
+            yield False
+
+        pages = export_pages()
+        scribbles = [s for p in range(self.nb_pages) for s in self.scribbles.get(p, [])]
+        self.scribbler.prepare_latex(scribbles, lambda: GLib.idle_add(lambda: next(pages, False)))
+
+    def export_xopp(self, filename=None, progress=None, done=None):
+        """ Export modified pdf to a (gzipped) xournal++ file, in a background thread
+
+        Args:
+            filename (`str`): the path of the exported file, by default next to the document
+            progress (`function`): called on the main thread with the exported fraction of the document
+            done (`function`): called on the main thread with the exception that stopped the export, or `None`
         """
         if filename is None:
             filename = self.path + '.xopp'
-        if f is None:
-            f = open(filename, "w")
-        print("""<?xml version="1.0" standalone="no"?>
-<xournal creator="pympress" fileversion="4">
-<title>Xournal++ document - see https://github.com/xournalpp/xournalpp</title>
-        """, file=f)
+        pages = self.xopp_snapshot()
+
+        def export():
+            with gzip.open(filename, 'wt', encoding='utf-8', compresslevel=6) as f:
+                self.write_xopp(pages, f, progress)
+
+        self.run_export(export, done)
+
+    def run_export(self, export, done=None):
+        """ Run an export in a thread, and report its end on the main thread
+
+        Args:
+            export (`function`): the export to run
+            done (`function`): called on the main thread with the exception that stopped the export, or `None`
+        """
+        def run():
+            error = None
+            try:
+                export()
+            except Exception as e:
+                logger.error('Export failed: {}'.format(e))
+                error = e
+            if done is not None:
+                GLib.idle_add(lambda: done(error) and False)
+
+        # Not a daemon, so that quitting does not leave a truncated file
+        threading.Thread(target=run, name='export').start()
+
+    def xopp_snapshot(self):
+        """ Copy what is needed to export the document, so that drawing can go on during the export
+
+        Returns:
+            `list`: for each page, a `tuple` of its width, height, pdf page number (-1 for blank pages) and scribbles
+        """
+        pages = []
         for p in range(self.nb_pages):
             page = self.page(p)
-            print(f"<page width=\"{page.pw}\" height=\"{page.ph}\">", file=f)
-            if self.page_map[p] >= 0:
-                print(f"<background type=\"pdf\" domain=\"absolute\" filename=\"{self.path}\" pageno=\"{self.page_map[p]+1}ll\"/>", file=f)
+            scribbles = []
+            for s in self.scribbles.get(p, []):
+                s = list(s)
+                s[3] = [tuple(pt) for pt in s[3]]
+                s[4] = [tuple(pt) for pt in s[4]]
+                scribbles.append(s)
+            pages.append((page.pw, page.ph, self.page_map[p], scribbles))
+        return pages
+
+    def write_xopp(self, pages, f, progress=None):
+        """ Write pages to a xournal++ file, one write per page
+
+        Args:
+            pages (`list`): the pages as returned by :meth:`~xopp_snapshot`
+            f (file object): the opened text file in which to write
+            progress (`function`): called on the main thread with the written fraction of the document
+        """
+        f.write("""<?xml version="1.0" standalone="no"?>
+<xournal creator="pympress" fileversion="4">
+<title>Xournal++ document - see https://github.com/xournalpp/xournalpp</title>
+\n""")
+        percent = 0
+        for p, (pw, ph, pdf_page, scribbles) in enumerate(pages):
+            out = [f"<page width=\"{pw}\" height=\"{ph}\">\n"]
+            if pdf_page >= 0:
+                out.append(f"<background type=\"pdf\" domain=\"absolute\" filename=\"{self.path}\" pageno=\"{pdf_page+1}ll\"/>\n")
             else:
-                print('<background type="solid" color="#ffffffff" style="plain"/>', file=f)
-            print("<layer>", file=f)
-            if p in self.scribbles:
-                for s in self.scribbles[p]:
-                    color = '#{:02x}{:02x}{:02x}{:02x}'.format(int(s[1][0]*255), int(s[1][1]*255), int(s[1][2]*255), int(s[1][3]*255))
-                    if s[0] == 'segment' and len(s[3]) > 1:
+                out.append('<background type="solid" color="#ffffffff" style="plain"/>\n')
+            out.append("<layer>\n")
+            for s in scribbles:
+                color = '#{:02x}{:02x}{:02x}{:02x}'.format(int(s[1][0]*255), int(s[1][1]*255), int(s[1][2]*255), int(s[1][3]*255))
+                if s[0] == 'segment' and len(s[3]) > 1:
+                    pen = "pen" if s[1][3] == 1 else "highlighter"
+                    out.append(f"<stroke tool=\"{pen}\" ts=\"0ll\" fn=\"\" color=\"{color}\" width=\"{s[2]}\">\n")
+                    out.extend('     {} {}\n'.format(i[0]*pw, i[1]*ph) for i in s[3])
+                    out.append("</stroke>\n")
+                if s[0] in ['box', "ellipse"]:
+                    if len(s) > 5 and s[5][3] > 0:
+                        fill_color = '#{:02x}{:02x}{:02x}{:02x}'.format(int(s[5][0]*255), int(s[5][1]*255), int(s[5][2]*255), int(s[5][3]*255))
+                        pen = "pen" if s[1][3] == 1 else "highlighter"
+                        out.append(f"<stroke tool=\"{pen}\" ts=\"0ll\" fn=\"\" color=\"{fill_color}\" width=\"{s[2]}\" fill=\"{int(s[5][3]*255)}\">\n")
+                        out.append(xopp_box_ellipse(s, pw, ph))
+                    if s[1][3] > 0:
                         pen = "pen" if s[1][3] == 1 else "highlighter"
-                        print(f"<stroke tool=\"{pen}\" ts=\"0ll\" fn=\"\" color=\"{color}\" width=\"{s[2]}\">", file=f)
-                        for i in s[3]:
-                            print("    ", i[0]*page.pw, i[1]*page.ph, file=f)
-                        print("</stroke>", file=f)
-                    if s[0] in ['box', "ellipse"]:
-                        if len(s) > 5 and s[5][3] > 0:
-                            fill_color = '#{:02x}{:02x}{:02x}{:02x}'.format(int(s[5][0]*255), int(s[5][1]*255), int(s[5][2]*255), int(s[5][3]*255))
-                            pen = "pen" if s[1][3] == 1 else "highlighter"
-                            print(f"<stroke tool=\"{pen}\" ts=\"0ll\" fn=\"\" color=\"{fill_color}\" width=\"{s[2]}\" fill=\"{int(s[5][3]*255)}\">", file=f)
-                            xopp_box_ellipse(s, page, f)
-                        if s[1][3] > 0:
-                            pen = "pen" if s[1][3] == 1 else "highlighter"
-                            print(f"<stroke tool=\"{pen}\" ts=\"0ll\" fn=\"\" color=\"{color}\" width=\"{s[2]}\">", file=f)
-                            xopp_box_ellipse(s, page, f)
-                    if s[0] == 'text' and s[5]:
-                        font = s[6].rsplit(' ', 1)
-                        x = s[4][0][0]*page.pw
-                        y = s[3][0][1]*page.ph
-                        text = xml_escape(s[5])
-                        print(f"<text font=\"{font[0]}\" size=\"{font[1]}\" x=\"{x}\" y=\"{y}\" ts=\"0ll\" color=\"{color}\">{text}</text>", file=f)
-                    if s[0] == 'image' and s[5]:
-                        x = s[4][0][0]*page.pw
-                        y = s[4][0][1]*page.ph
-                        x1 = s[4][1][0]*page.pw
-                        y1 = s[4][1][1]*page.ph
-                        image = base64.b64encode(s[5].save_to_bufferv('png',[],[])[1]).decode('ascii')
-                        print(f'<image left="{x}" top="{y}" right="{x1}" bottom="{y1}">{image}</image>', file=f)
-                    if s[0] == 'latex' and s[5]:
-                        x = s[4][0][0]*page.pw
-                        y = s[4][0][1]*page.ph
-                        x1 = s[4][1][0]*page.pw
-                        y1 = s[4][1][1]*page.ph
-                        png = self.scribbler.latex_to_pixbuf(s[5], 300, s[1], png=True)
-                        if png:
-                            image = base64.b64encode(png).decode('ascii')
-                            print(f'<teximage text="{s[5]}" left="{x}" top="{y}" right="{x1}" bottom="{y1}">{image}</teximage>', file=f)
-            print("</layer>", file=f)
-            print("</page>", file=f)
-        print("</xournal>", file=f)
+                        out.append(f"<stroke tool=\"{pen}\" ts=\"0ll\" fn=\"\" color=\"{color}\" width=\"{s[2]}\">\n")
+                        out.append(xopp_box_ellipse(s, pw, ph))
+                if s[0] == 'text' and s[5]:
+                    font = s[6].rsplit(' ', 1)
+                    x = s[4][0][0]*pw
+                    y = s[3][0][1]*ph
+                    text = xml_escape(s[5])
+                    out.append(f"<text font=\"{font[0]}\" size=\"{font[1]}\" x=\"{x}\" y=\"{y}\" ts=\"0ll\" color=\"{color}\">{text}</text>\n")
+                if s[0] == 'image' and s[5]:
+                    x = s[4][0][0]*pw
+                    y = s[4][0][1]*ph
+                    x1 = s[4][1][0]*pw
+                    y1 = s[4][1][1]*ph
+                    image = base64.b64encode(s[5].save_to_bufferv('png',[],[])[1]).decode('ascii')
+                    out.append(f'<image left="{x}" top="{y}" right="{x1}" bottom="{y1}">{image}</image>\n')
+                if s[0] == 'latex' and s[5]:
+                    x = s[4][0][0]*pw
+                    y = s[4][0][1]*ph
+                    x1 = s[4][1][0]*pw
+                    y1 = s[4][1][1]*ph
+                    # Same resolution as on screen, to reuse the images already compiled for display
+                    png = self.scribbler.latex_to_pixbuf(s[5], self.scribbler.latex_resolution(), s[1], png=True)
+                    if png:
+                        image = base64.b64encode(png).decode('ascii')
+                        text = xml_escape(s[5], {'"': '&quot;'})
+                        out.append(f'<teximage text="{text}" left="{x}" top="{y}" right="{x1}" bottom="{y1}">{image}</teximage>\n')
+            out.append("</layer>\n</page>\n")
+            f.write(''.join(out))
+
+            if progress is not None and (p + 1) * 100 // len(pages) > percent:
+                percent = (p + 1) * 100 // len(pages)
+                GLib.idle_add(lambda fraction: progress(fraction) and False, percent / 100)
+        f.write("</xournal>\n")
 
 
     def get_structure(self, index_iter = None):
@@ -1227,6 +1350,27 @@ class Document(object):
             return 0
 
 
+    def overlay_base(self, pdf_page):
+        """ Get the first pdf page of the run of consecutive pdf pages that share a label, e.g. beamer overlays.
+
+        Args:
+            pdf_page (`int`):  number of a page in the pdf file
+
+        Returns:
+            `int`: the number of the first pdf page with the same label, or pdf_page if it has no label
+        """
+        if pdf_page <= 0:
+            return pdf_page
+
+        label = self.doc.get_page(pdf_page).get_label()
+        if not label:
+            return pdf_page
+
+        while pdf_page > 0 and self.doc.get_page(pdf_page - 1).get_label() == label:
+            pdf_page -= 1
+        return pdf_page
+
+
     def label_next(self, *args):
         """ Switch to the next page with different label.
         """
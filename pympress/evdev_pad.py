@@ -8,19 +8,21 @@
 import os
 import time
 import threading
+import collections
 import gi
 gi.require_version('Gtk', '3.0')
 from gi.repository import Gdk, GLib
-try:
-    import evdev
-except ModuleNotFoundError:
-    pass
+
+#: The evdev module, imported by the devices thread rather than during start up
+evdev = None
 
 class PenEventLoop():
     pressed_buttons = set()
     pen_thread = None
     buttons_thread = None
     pen_range = None
+    #: `tuple` of min and max pressure reported by the pen, or `None` if pressure is ignored
+    pressure_range = None
     collect_coords = {'x': -1, 'y': -1, 'p': -1, 'last': (-1, -1)}
     scribbler = None
     exchange_xy = True
@@ -29,12 +31,71 @@ class PenEventLoop():
     quit = False
     have_dev = False
     pen_dev = None
+    #: Ring buffer of pen events, filled by the pen thread and drained by the main loop once per frame. Each event is
+    #: a `tuple` of the data of a button change (or `None`) and of the position of a pen sample (or `None`), so that
+    #: button changes and samples are handled in the order they happened.
+    pen_samples = None
+    #: Latest position of the hovering pen, only the last one matters
+    pointer_sample = None
+    #: Whether the main loop has been asked to drain the samples
+    drain_scheduled = False
+    #: The button of a pen touch, waiting for the position reported with it to be posted
+    pending_touch = None
 
     def __init__(self, scr):
         self.scribbler = scr
+        self.pen_samples = collections.deque(maxlen=4096)
+        # Look for devices once the windows are up, rather than during start up
+        GLib.idle_add(self.start)
+
+    def start(self):
+        """ Start the thread looking for pen and pad devices.
+        """
         threading.Thread(target=self.devices_thread, daemon=True).start()
+        return False
+
+    def push_sample(self, point, pointer=False, button=None):
+        """ Buffer a sample or a button change from the pen thread, and make sure the main loop will drain it.
+
+        Appending to and popping from a deque are atomic, so no lock is needed.
+
+        Args:
+            point (`tuple`): the position of the pen on the pad, or `None` for a button change
+            pointer (`bool`): whether the pen is hovering rather than touching the pad
+            button (`tuple`): the event type, position and button of a button change, or `None` for a sample
+        """
+        if pointer:
+            self.pointer_sample = point
+        else:
+            self.pen_samples.append((button, point))
+        if not self.drain_scheduled:
+            self.drain_scheduled = True
+            GLib.idle_add(self.scribbler.evdev_schedule_drain)
+
+    def pop_samples(self):
+        """ Get all the samples and button changes buffered since the last call, from the main loop.
+
+        Returns:
+            `tuple`: the `list` of pen events (see :attr:`pen_samples`), and the last pointer position or `None`
+        """
+        # Clear the flag first: samples pushed after this point schedule a new drain
+        self.drain_scheduled = False
+        points = []
+        while True:
+            try:
+                points.append(self.pen_samples.popleft())
+            except IndexError:
+                break
+        pointer, self.pointer_sample = self.pointer_sample, None
+        return points, pointer
 
     def devices_thread(self):
+        global evdev
+        try:
+            import evdev
+        except ModuleNotFoundError:
+            return
+
         while not self.quit:
             if not self.have_dev:
                 self.start_devices(self)
@@ -53,6 +114,10 @@ class PenEventLoop():
             self.pen_range = (
                 (self.pen_dev.capabilities()[3][0][1].min, self.pen_dev.capabilities()[3][0][1].max),
                 (self.pen_dev.capabilities()[3][1][1].min, self.pen_dev.capabilities()[3][1][1].max))
+            pressure = dict(self.pen_dev.capabilities()[3]).get(evdev.ecodes.ABS_PRESSURE)
+            if pressure and pressure.max > pressure.min and \
+                    self.scribbler.config.getboolean('penpad', 'pressure', fallback=True):
+                self.pressure_range = (pressure.min, pressure.max)
             self.pen_thread = threading.Thread(target=self.pen_event_loop, daemon=True)
             if self.pen_thread:
                 self.pen_thread.start()
@@ -102,19 +167,20 @@ class PenEventLoop():
                     if event.value == evdev.KeyEvent.key_up:
                         self.pressed_buttons.difference_update({event.code})
                         if event.code == evdev.ecodes.BTN_DIGI:
+                            self.pointer_sample = None
                             GLib.idle_add(self.scribbler.evdev_callback_pointer, ())
                         else:
-                            GLib.idle_add(self.scribbler.evdev_callback_track,
-                                (Gdk.EventType.BUTTON_RELEASE, self.collect_coords['last'],
-                                 (True, Gdk.BUTTON_SECONDARY if evdev.ecodes.BTN_STYLUS in self.pressed_buttons
+                            self.pending_touch = None
+                            self.push_sample(None, button=(Gdk.EventType.BUTTON_RELEASE, self.collect_coords['last'],
+                                (True, Gdk.BUTTON_SECONDARY if evdev.ecodes.BTN_STYLUS in self.pressed_buttons
                                  else Gdk.BUTTON_PRIMARY)))
                     else:
                         self.pressed_buttons.add(event.code)
                         if event.code == evdev.ecodes.BTN_TOUCH:
-                            GLib.idle_add(self.scribbler.evdev_callback_track,
-                                (Gdk.EventType.BUTTON_PRESS, self.collect_coords['last'],
-                                 (True, Gdk.BUTTON_SECONDARY if evdev.ecodes.BTN_STYLUS in self.pressed_buttons
-                                 else Gdk.BUTTON_PRIMARY)))
+                            # Posted with the position of the same report, at EV_SYN
+                            self.pending_touch = (True, Gdk.BUTTON_SECONDARY
+                                                  if evdev.ecodes.BTN_STYLUS in self.pressed_buttons
+                                                  else Gdk.BUTTON_PRIMARY)
                 if event.type == evdev.ecodes.EV_ABS:
                     #print(f"in EV_ABS {event.code=}")
                     if event.code == 0:
@@ -125,6 +191,7 @@ class PenEventLoop():
                         self.collect_coords['p'] = event.value
                 if event.type == evdev.ecodes.EV_SYN:
                     #print(f"in EV_SYM {self.collect_coords=} {self.pressed_buttons}")
+                    point = None
                     if self.collect_coords['x'] > -1 and self.collect_coords['y'] > -1:
                         point = ((self.collect_coords['x'] - self.pen_range[0][0]) /
                                  (self.pen_range[0][1] - self.pen_range[0][0]),
@@ -136,13 +203,22 @@ class PenEventLoop():
                             point = (1 - point[0], point[1])
                         if self.mirror_y:
                             point = (point[0], 1 - point[1])
+                        # Pressure is only reported when it changes, so keep the last value
+                        if self.pressure_range and self.collect_coords['p'] > -1:
+                            point = point + ((self.collect_coords['p'] - self.pressure_range[0]) /
+                                             (self.pressure_range[1] - self.pressure_range[0]),)
                         self.collect_coords['x'] = -1
                         self.collect_coords['y'] = -1
                         self.collect_coords['last'] = point
+                    if self.pending_touch is not None:
+                        self.push_sample(None, button=(Gdk.EventType.BUTTON_PRESS, self.collect_coords['last'],
+                                                       self.pending_touch))
+                        self.pending_touch = None
+                    if point is not None:
                         if evdev.ecodes.BTN_TOUCH in self.pressed_buttons:
-                            GLib.idle_add(self.scribbler.evdev_callback_pen, point)
+                            self.push_sample(point)
                         elif evdev.ecodes.BTN_DIGI in self.pressed_buttons or not self.pressed_buttons:
-                            GLib.idle_add(self.scribbler.evdev_callback_pointer, point)
+                            self.push_sample(point, pointer=True)
                     pass
         except OSError:
             self.have_dev = False
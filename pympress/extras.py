@@ -35,7 +35,7 @@ gi.require_version('Gtk', '3.0')
 from gi.repository import Gtk, Gdk, GLib
 
 import mimetypes
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 
 from pympress import document, builder, config
 from pympress.media_overlays.base import VideoOverlay
@@ -53,10 +53,21 @@ class TimingReport(builder.Builder):
     #: A :class:`~Gtk.Dialog` to contain the timing to show.
     time_report_dialog = None
 
+    #: The :class:`~Gtk.Window` for which the dialog is shown
+    parent_win = None
+
     def __init__(self, parent):
         super(TimingReport, self).__init__()
+        self.parent_win = parent.p_win
+
+
+    def load_dialog(self):
+        """ Build the dialog the first time it is shown, rather than at start up.
+        """
+        if self.time_report_dialog is not None:
+            return
         self.load_ui('time_report_dialog')
-        self.time_report_dialog.set_transient_for(parent.p_win)
+        self.time_report_dialog.set_transient_for(self.parent_win)
         self.time_report_dialog.add_button(Gtk.STOCK_CLOSE, Gtk.ResponseType.CLOSE)
         self.connect_signals(self)
 
@@ -98,6 +109,7 @@ class TimingReport(builder.Builder):
             doc_structure (`dict`): the structure of the document
             page_labels (`list`): the page labels for each of the pages
         """
+        self.load_dialog()
         times = [time for page, time in self.page_time] + [current_time if self.reset_time < 0 else self.reset_time]
         durations = (e - s for e, s in zip(times[1:], times[:-1]))
 
@@ -206,8 +218,17 @@ class Media(object):
         builder (:class:`~pympress.builder.Builder`): A builder from which to load widgets
         conf (:class:`~pympress.config.Config`): An object containing the preferences
     """
-    #: `dict` of :class:`~pympress.media_overlays.base.VideoOverlay` ready to be added on top of the slides
-    _media_overlays = {}
+    #: :class:`~collections.OrderedDict` of pairs of :class:`~pympress.media_overlays.base.VideoOverlay` ready to be
+    #: added on top of the slides, indexed by media id, least recently used first
+    _media_overlays = None
+    #: Maximum number of pairs of players kept in :attr:`_media_overlays`
+    max_overlays = 8
+    #: `set` of the media ids of the current page, which are never evicted
+    _current_ids = None
+    #: `list` of media waiting to be preloaded, as `tuple` of media info and page type
+    _preload_queue = None
+    #: `int` identifying the :func:`~GLib.idle_add` source preloading media, or 0
+    _preload_source = 0
 
     #: :class:`~Gtk.Overlay` for the Content window.
     c_overlay = None
@@ -221,10 +242,17 @@ class Media(object):
     _backends = {}
     # `list` of info on backend versions
     _backend_versions = []
+    #: :class:`~pympress.config.Config` with which to set up the backends
+    _conf = None
 
     def __init__(self, builder, conf):
         super(Media, self).__init__()
-        self._setup_backends(conf)
+        # Backends are only set up once a page has media, see get_factory()
+        Media._conf = conf
+        self._media_overlays = OrderedDict()
+        self._current_ids = set()
+        self._preload_queue = []
+        self.max_overlays = max(1, conf.getint('cache', 'media_pool', fallback=8))
         builder.load_widgets(self)
 
         self.c_overlay.queue_draw()
@@ -239,10 +267,75 @@ class Media(object):
 
 
     def purge_media_overlays(self):
-        """ Remove current media overlays.
+        """ Remove current media overlays, and forget all the players and the ones waiting to be preloaded.
         """
         self.remove_media_overlays()
+        for media_id in self._media_overlays:
+            for w in self._media_overlays[media_id]:
+                w.release()
         self._media_overlays.clear()
+        self._current_ids = set()
+        del self._preload_queue[:]
+
+
+    def get_media_overlays(self, media, page_type):
+        """ Get the pair of players for a media, building them if they are not in the pool.
+
+        Args:
+            media (`tuple`): the relative margins, file name and whether to show controls, as in
+                             :meth:`~pympress.document.Page.get_media`
+            page_type (:class:`~pympress.document.PdfPage`): The part of the page to consider
+
+        Returns:
+            `tuple`: the media id and the players for the content and presenter windows, or `None` if no player exists
+        """
+        relative_margins, filename, show_controls = media
+        media_id = hash(media)
+
+        if media_id in self._media_overlays:
+            self._media_overlays.move_to_end(media_id)
+            return media_id, self._media_overlays[media_id]
+
+        mime_type, enc = mimetypes.guess_type(filename)
+        factory = self.get_factory(mime_type)
+
+        if not factory:
+            logger.warning('No available overlay for mime type {}, ignoring media {}'.format(mime_type, filename))
+            return None
+
+        def get_curryfied_callback(name, media_id = media_id):
+            """ Return a callback for signal 'name' that has the value 'media_id' pre-set, and remembered by this closure.
+            """
+            return lambda *args: VideoOverlay.find_callback_handler(self, name)(media_id, *args)
+
+        v_da_c = factory(self.c_overlay, show_controls, relative_margins, page_type, get_curryfied_callback)
+        v_da_p = factory(self.p_overlay, True, relative_margins, page_type, get_curryfied_callback)
+
+        v_da_c.set_file(filename)
+        v_da_p.set_file(filename)
+
+        if factory.shared_decode:
+            v_da_c.share_decoder(v_da_p)
+
+        self._media_overlays[media_id] = (v_da_c, v_da_p)
+        self.trim_media_overlays()
+
+        return media_id, self._media_overlays[media_id]
+
+
+    def trim_media_overlays(self):
+        """ Release the least recently used players that are not on the current page, until the pool fits its size.
+        """
+        for media_id in list(self._media_overlays):
+            if len(self._media_overlays) <= self.max_overlays:
+                break
+            if media_id in self._current_ids:
+                continue
+
+            for w in self._media_overlays.pop(media_id):
+                if w.is_shown():
+                    w.do_hide()
+                w.release()
 
 
     def replace_media_overlays(self, current_page, page_type):
@@ -256,39 +349,68 @@ class Media(object):
             return
 
         self.remove_media_overlays()
+        self._current_ids = {hash(media) for media in current_page.get_media()}
+
+        for media in current_page.get_media():
+            overlays = self.get_media_overlays(media, page_type)
+            if overlays is None:
+                continue
+
+            media_id, (v_da_c, v_da_p) = overlays
+            v_da_c.mute(True)
+            v_da_p.mute(False)
+
+            for w in (v_da_c, v_da_p):
+                try:
+                    w.preload()
+                except Exception:
+                    logger.warning('Failed to preload media {}'.format(media[1]), exc_info = True)
+                if w.autoplay:
+                    w.set_time(0)
+                    w.show()
+
 
-        for relative_margins, filename, show_controls in current_page.get_media():
-            media_id = hash((relative_margins, filename, show_controls))
+    def preload_media_overlays(self, pages, page_type):
+        """ Prepare the players of the media in upcoming pages, one at a time when the main loop is idle.
 
-            if media_id not in self._media_overlays:
-                mime_type, enc = mimetypes.guess_type(filename)
-                factory = self.get_factory(mime_type)
+        Args:
+            pages (`list` of :class:`~pympress.document.Page`): The pages for which to prepare medias, most urgent first
+            page_type (:class:`~pympress.document.PdfPage`): The part of the page to consider
+        """
+        if page_type == document.PdfPage.NONE:
+            return
 
-                if not factory:
-                    logger.warning('No available overlay for mime type {}, ignoring media {}'
-                                   .format(mime_type, filename))
-                    continue
+        # Do not preload more than the pool holds besides the current page, or we would evict our own preloads
+        room = self.max_overlays - len(self._current_ids)
+        medias = [media for page in pages if page is not None for media in page.get_media()][:max(0, room)]
+        self._preload_queue[:] = [(media, page_type) for media in medias if hash(media) not in self._media_overlays]
 
-                def get_curryfied_callback(name, media_id = media_id):
-                    """ Return a callback for signal 'name' that has the value 'media_id' pre-set, and remembered by this closure.
-                    """
-                    return lambda *args: VideoOverlay.find_callback_handler(self, name)(media_id, *args)
+        if self._preload_queue and not self._preload_source:
+            self._preload_source = GLib.idle_add(self.preload_next, priority = GLib.PRIORITY_LOW)
 
-                v_da_c = factory(self.c_overlay, show_controls, relative_margins, page_type, get_curryfied_callback)
-                v_da_p = factory(self.p_overlay, True, relative_margins, page_type, get_curryfied_callback)
 
-                v_da_c.set_file(filename)
-                v_da_p.set_file(filename)
+    def preload_next(self):
+        """ Build the players for the next media waiting to be preloaded. Runs with :func:`~GLib.idle_add`.
 
-                self._media_overlays[media_id] = (v_da_c, v_da_p)
+        Returns:
+            `bool`: `True` iff there are more media waiting to be preloaded (:func:`~GLib.idle_add` convention)
+        """
+        if not self._preload_queue:
+            self._preload_source = 0
+            return False
 
-            self._media_overlays[media_id][0].mute(True)
-            self._media_overlays[media_id][1].mute(False)
+        media, page_type = self._preload_queue.pop(0)
+        try:
+            overlays = self.get_media_overlays(media, page_type)
+            if overlays is not None:
+                for w in overlays[1]:
+                    w.preload()
+        except Exception:
+            logger.warning('Failed to preload media {}'.format(media[1]), exc_info = True)
 
-            for w in self._media_overlays[media_id]:
-                if w.autoplay:
-                    w.set_time(0)
-                    w.show()
+        if not self._preload_queue:
+            self._preload_source = 0
+        return bool(self._preload_queue)
 
 
     def resize(self, which = None):
@@ -322,7 +444,7 @@ class Media(object):
             c, p = self._media_overlays[media_id]
             p.show()
             c.show()
-            GLib.idle_add(lambda: any(p.do_play() for p in self._media_overlays[media_id]))
+            GLib.idle_add(lambda: any(p.do_play() for p in self._media_overlays.get(media_id, ())))
 
 
     def hide(self, media_id, button = None):
@@ -352,7 +474,7 @@ class Media(object):
         Args:
             media_id (`int`): A unique idientifier of the media to start playing
         """
-        GLib.idle_add(lambda: any(p.do_play_pause() for p in self._media_overlays[media_id]))
+        GLib.idle_add(lambda: any(p.do_play_pause() for p in self._media_overlays.get(media_id, ())))
 
 
     def set_time(self, media_id, t, *args):
@@ -362,7 +484,7 @@ class Media(object):
             media_id (`int`): A unique idientifier of the media to start playing
             t (`float`): the timestamp, in s
         """
-        GLib.idle_add(lambda: any(p.do_set_time(t) for p in self._media_overlays[media_id]))
+        GLib.idle_add(lambda: any(p.do_set_time(t) for p in self._media_overlays.get(media_id, ())))
 
 
     @classmethod
@@ -374,7 +496,7 @@ class Media(object):
 
         cls._backends_setup = True
         if conf is None:
-            conf = config.Config()
+            conf = cls._conf if cls._conf is not None else config.Config()
 
         try:
             from pympress.media_overlays.gif_backend import GifOverlay
@@ -395,6 +517,8 @@ class Media(object):
                 from pympress.media_overlays.gst_backend import GstOverlay
 
                 version = GstOverlay.setup_backend(conf.getlist('gst', 'init_options'))
+                GstOverlay.shared_decode = conf.getboolean('gst', 'shared_decode', fallback=False)
+                GstOverlay.downscale_presenter = conf.getboolean('gst', 'downscale_presenter', fallback=True)
 
                 types_list = conf.getlist('gst', 'mime_types')
                 cls._backends.update({mt: GstOverlay for mt in types_list})
@@ -427,6 +551,8 @@ class Media(object):
             logger.error(_("Video support using {} is disabled.").format('VLC'))
             logger.info(_('Caused by ') + type(e).__name__ + ': ' + str(e))
 
+        logger.info('Media: ' + ', '.join(cls._backend_versions))
+
 
     @classmethod
     def backend_version(cls):
@@ -505,7 +631,7 @@ class Zoom(object):
     p_central = None
 
     #: callback, to be connected to :func:`~pympress.ui.UI.redraw_current_slide`
-    redraw_current_slide = lambda: None
+    redraw_current_slide = lambda *args: None
     #: callback, to be connected to :func:`~pympress.ui.UI.clear_cache`
     clear_cache = lambda: None
 
@@ -555,7 +681,7 @@ class Zoom(object):
         self.set_scribble_zoomout_sensitive(False)
         self.menu_zoom_out.set_sensitive(False)
 
-        self.redraw_current_slide()
+        self.redraw_current_slide('zoom')
         self.clear_cache()
 
         return True
@@ -620,7 +746,7 @@ class Zoom(object):
         if self.zoom_selecting and self.zoom_points:
             self.zoom_points[1] = self.get_slide_point(widget, event)
 
-            self.redraw_current_slide()
+            self.redraw_current_slide('zoom')
             return True
 
         return False
@@ -668,7 +794,7 @@ class Zoom(object):
 
             self.zoom_selecting = False
             self.clear_cache()
-            self.redraw_current_slide()
+            self.redraw_current_slide('zoom')
             self.set_scribble_zoomout_sensitive(True)
             self.menu_zoom_out.set_sensitive(True)
 
@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+#
+#       latex.py
+"""
+:mod:`pympress.latex` -- Compile LaTeX scribbles to images, off the main thread
+-------------------------------------------------------------------------------
+"""
+import os
+import hashlib
+import tempfile
+import threading
+import collections
+import concurrent.futures
+
+import logging
+logger = logging.getLogger(__name__)
+
+import gi
+gi.require_version('Gtk', '3.0')
+from gi.repository import GLib, GdkPixbuf
+
+from pympress import util
+
+
+def is_valid(text):
+    """ Rudimentary check for legal latex string
+
+    Args:
+        text (`str`): the latex source
+
+    Returns:
+        `bool`: whether it is worth trying to compile text
+    """
+    return not text.count("$") % 2 and text.count("\\begin") == text.count("\\end")
+
+
+def png_to_pixbuf(png):
+    """ Decode PNG data to a pixbuf
+
+    Args:
+        png (`bytes`): PNG data, or `None`
+
+    Returns:
+        :class:`~GdkPixbuf.Pixbuf`: the decoded image, or `None`
+    """
+    if not png:
+        return None
+    loader = GdkPixbuf.PixbufLoader.new_with_type('png')
+    try:
+        loader.write(png)
+        loader.close()
+    except GLib.Error:
+        return None
+    return loader.get_pixbuf()
+
+
+class ShortcutTrie(object):
+    """ Prefix tree of typing shortcuts, telling in a single walk whether a word is a shortcut and whether a longer
+    shortcut starts with it.
+
+    Args:
+        shortcuts (`dict`): replacement strings indexed by shortcut
+    """
+    #: Nested `dict` of characters, where the `None` key holds the replacement of the shortcut ending there
+    root = None
+    #: Length of the longest shortcut
+    depth = 0
+
+    def __init__(self, shortcuts):
+        self.root = {}
+        for key, value in shortcuts.items():
+            node = self.root
+            for c in key:
+                node = node.setdefault(c, {})
+            node[None] = value
+            self.depth = max(self.depth, len(key))
+
+
+    def lookup(self, word):
+        """ Find a word in the tree
+
+        Args:
+            word (`str`): the typed shortcut
+
+        Returns:
+            `tuple`: the replacement of word, or `None`, and whether longer shortcuts start with word
+        """
+        node = self.root
+        for c in word:
+            node = node.get(c)
+            if node is None:
+                return None, False
+        return node.get(None), len(node) > (None in node)
+
+
+class LatexRenderer(object):
+    """ Content-addressed cache of compiled latex strings, in memory and on disk, with a pool of compiling threads.
+
+    Args:
+        config (:class:`~pympress.config.Config`): A config object containing preferences
+    """
+    #: :class:`~collections.OrderedDict` of PNG `bytes` indexed by hash of text, color and size, most recent last
+    cache = None
+    #: Maximum number of images kept in memory
+    max_cache = 256
+    #: :class:`~threading.Lock` protecting :attr:`cache`
+    lock = None
+    #: Directory where images are kept across runs, or `None`
+    disk_dir = None
+    #: :class:`~concurrent.futures.ThreadPoolExecutor` running the compilations
+    pool = None
+    #: `dict` of the `list` of callbacks waiting for compilations in progress, indexed by key
+    pending = None
+
+    def __init__(self, config):
+        self.cache = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.max_cache = config.getint('scribble', 'latex_cache', fallback=256)
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=config.getint('scribble', 'latex_workers', fallback=2),
+                                                          thread_name_prefix='latex')
+        if config.getboolean('scribble', 'latex_disk_cache', fallback=True):
+            try:
+                self.disk_dir = util.get_cache_dir('latex')
+            except OSError as e:
+                logger.warning('Can not cache latex images on disk: {}'.format(e))
+
+
+    @staticmethod
+    def key(text, size, color):
+        """ Content address of a compiled latex string
+
+        Args:
+            text (`str`): the latex source
+            size (`int`): the resolution passed to dvipng
+            color (`tuple`): the rgb(a) color of the text
+
+        Returns:
+            `str`: a hash identifying the image
+        """
+        desc = '{}\0{}\0{:.4f},{:.4f},{:.4f}'.format(text, size, *color[:3])
+        return hashlib.sha1(desc.encode('utf-8')).hexdigest()
+
+
+    def lookup(self, key):
+        """ Get a compiled image from the memory or disk cache
+
+        Args:
+            key (`str`): the content address of the image
+
+        Returns:
+            `bytes`: the PNG data, or `None` if not cached
+        """
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+
+        if self.disk_dir is None:
+            return None
+        try:
+            with open(os.path.join(self.disk_dir, key + '.png'), 'rb') as f:
+                png = f.read()
+        except OSError:
+            return None
+
+        self.store(key, png, disk=False)
+        return png
+
+
+    def store(self, key, png, disk=True):
+        """ Add a compiled image to the memory cache, and optionally the disk cache
+
+        Args:
+            key (`str`): the content address of the image
+            png (`bytes`): the PNG data
+            disk (`bool`): whether to also write the image to disk
+        """
+        with self.lock:
+            self.cache[key] = png
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.max_cache:
+                self.cache.popitem(last=False)
+
+        if disk and self.disk_dir is not None:
+            tmp = None
+            try:
+                fd, tmp = tempfile.mkstemp(suffix='.png', dir=self.disk_dir)
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(png)
+                os.replace(tmp, os.path.join(self.disk_dir, key + '.png'))
+            except OSError as e:
+                logger.warning('Can not cache latex image on disk: {}'.format(e))
+                try:
+                    if tmp is not None:
+                        os.unlink(tmp)
+                except OSError:
+                    pass
+
+
+    @staticmethod
+    def compile(text, size, color):
+        """ Run latex and dvipng on a string, in a private temporary directory
+
+        Args:
+            text (`str`): the latex source
+            size (`int`): the resolution passed to dvipng
+            color (`tuple`): the rgb(a) color of the text
+
+        Returns:
+            `bytes`: the PNG data, or `None` if compilation failed
+        """
+        preamble = """ \\documentclass[varwidth,12pt]{standalone}
+            \\usepackage{amsmath,amsfonts,xcolor}
+            \\begin{document}
+            \\color[rgb]{%f,%f,%f}
+        """ % (color[0], color[1], color[2])
+        # sympy is slow to import, only do it once latex is actually compiled
+        import sympy
+
+        with tempfile.TemporaryDirectory(prefix='pympress-latex-') as tmp_dir:
+            fn = os.path.join(tmp_dir, 'ppl.png')
+            try:
+                sympy.preview("\\color[rgb]{%f,%f,%f}\n%s" % (color[0], color[1], color[2], text),
+                              output='png', viewer="file", filename=fn, euler=False,
+                              preamble=preamble,
+                              dvioptions=["-T", "tight", "-z", "0", "--truecolor", "-D " + str(size)])
+                with open(fn, 'rb') as f:
+                    return f.read()
+            except Exception as e:
+                logger.debug('latex compilation failed: {}'.format(e))
+                return None
+
+
+    def render(self, text, size, color):
+        """ Get the image of a latex string, compiling it synchronously if it is not cached
+
+        Args:
+            text (`str`): the latex source
+            size (`int`): the resolution passed to dvipng
+            color (`tuple`): the rgb(a) color of the text
+
+        Returns:
+            `bytes`: the PNG data, or `None` (or empty `bytes`) if the string does not compile
+        """
+        if not is_valid(text):
+            return None
+        key = self.key(text, size, color)
+        png = self.lookup(key)
+        if png is None:
+            png = self.compile(text, size, color)
+            # Remember failures in memory only, so that exports do not compile them again
+            self.store(key, png or b'', disk=png is not None)
+        return png
+
+
+    def render_async(self, text, size, color, callback):
+        """ Get the image of a latex string, compiling it in the thread pool if it is not cached.
+
+        The callback is always called on the main thread, immediately when the image is in memory.
+
+        Args:
+            text (`str`): the latex source
+            size (`int`): the resolution passed to dvipng
+            color (`tuple`): the rgb(a) color of the text
+            callback (`function`): called with the PNG `bytes`, or `None` (or empty `bytes`) if the string does not
+                compile
+        """
+        if not is_valid(text):
+            callback(None)
+            return
+
+        key = self.key(text, size, color)
+        with self.lock:
+            png = self.cache.get(key)
+        if png is not None:
+            callback(png)
+            return
+
+        if key in self.pending:
+            self.pending[key].append(callback)
+            return
+
+        self.pending[key] = [callback]
+        future = self.pool.submit(self.render, text, size, color)
+        future.add_done_callback(lambda f: GLib.idle_add(self.deliver, key, f))
+
+
+    def deliver(self, key, future):
+        """ Pass the result of a compilation to the callbacks waiting for it, on the main thread
+
+        Args:
+            key (`str`): the content address of the image
+            future (:class:`~concurrent.futures.Future`): the finished compilation
+        """
+        callbacks = self.pending.pop(key, [])
+        try:
+            png = future.result()
+        except Exception as e:
+            logger.warning('Can not render latex string: {}'.format(e))
+            png = None
+
+        for callback in callbacks:
+            callback(png)
+        return False
@@ -34,6 +34,10 @@ logger = logging.getLogger(__name__)
 
 import ctypes
 
+import gi
+gi.require_version('Gtk', '3.0')
+from gi.repository import GLib
+
 from pympress import builder
 
 
@@ -82,6 +86,8 @@ class VideoOverlay(builder.Builder):
     relative_margins = None
     #: `bool` that tracks whether we should play automatically
     autoplay = False
+    #: `bool` whether the backend can display both overlays of a media from a single player, see :meth:`share_decoder`
+    shared_decode = False
 
     #: callback, to be connected to :meth:`~pympress.extras.Media.play`, curryfied with the correct media_id
     play = None
@@ -100,6 +106,14 @@ class VideoOverlay(builder.Builder):
     time_format = '{:01}:{:02}'
     #: `float` holding the max time in s
     maxval = 1
+    #: `float` holding the latest time reported by the player
+    position = 0
+    #: `float` holding the latest time reported by the player, not yet displayed in the progress bar
+    pending_progress = None
+    #: `bool` that tracks whether displaying :attr:`pending_progress` is scheduled
+    progress_scheduled = False
+    #: `int` minimal interval between two updates of the progress bar, in ms
+    progress_interval = 100
 
     def __init__(self, container, show_controls, relative_margins, page_type, callback_getter):
         super(VideoOverlay, self).__init__()
@@ -150,10 +164,40 @@ class VideoOverlay(builder.Builder):
     def update_progress(self, time):
         """ Update the toolbar slider to the current time.
 
+        Safe to call from the player's threads: updates are coalesced and displayed at most every
+        :attr:`progress_interval` ms on the main thread.
+
         Args:
             time (`float`): The time in this video in s
         """
-        self.progress.set_value(time)
+        self.position = time
+        self.pending_progress = time
+        if not self.progress_scheduled:
+            self.progress_scheduled = True
+            GLib.timeout_add(self.progress_interval, self.show_progress)
+
+
+    def show_progress(self):
+        """ Display the latest time in the toolbar slider, if it is visible. Runs on the main thread.
+
+        Returns:
+            `bool`: `True` iff this function should be run again (:func:`~GLib.timeout_add` convention)
+        """
+        self.progress_scheduled = False
+        if self.pending_progress is not None and self.toolbar.get_visible() and self.is_shown():
+            self.progress.set_value(self.pending_progress)
+        self.pending_progress = None
+        return False
+
+
+    def show_position(self, toolbar):
+        """ Display the latest time in the toolbar slider when it appears, connected to its
+        :attr:`~.Gtk.Widget.signals.map` signal, as the updates are skipped while it is not visible.
+
+        Args:
+            toolbar (:class:`~Gtk.Widget`): The toolbar containing the slider
+        """
+        self.progress.set_value(self.position)
 
 
     def progress_moved(self, rng, sc, val):
@@ -222,6 +266,27 @@ class VideoOverlay(builder.Builder):
         raise NotImplementedError
 
 
+    def share_decoder(self, follower):
+        """ Display another overlay of the same media from this overlay's player, which then controls both.
+
+        Args:
+            follower (:class:`~pympress.media_overlays.base.VideoOverlay`): The overlay showing the same media
+        """
+        raise NotImplementedError
+
+
+    def preload(self):
+        """ Prepare the backend player ahead of time, so that playing starts without delay. Does nothing by default.
+        """
+        pass
+
+
+    def release(self):
+        """ Free the resources of the backend player, before the widget is discarded.
+        """
+        self.do_stop()
+
+
     def show(self):
         """ Bring the widget to the top of the overlays if necessary.
         """
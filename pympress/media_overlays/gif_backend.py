@@ -28,6 +28,9 @@ from __future__ import print_function, unicode_literals
 import logging
 logger = logging.getLogger(__name__)
 
+import weakref
+import collections
+
 import gi
 import cairo
 gi.require_version('Gtk', '3.0')
@@ -37,17 +40,296 @@ from gi.repository import Gdk, GLib, GdkPixbuf
 from pympress.media_overlays import base
 
 
-class GifOverlay(base.VideoOverlay):
-    """ A simple overlay mimicking the functionality of showing videos, but showing gifs instead.
+def count_gif_frames(filepath):
+    """ Count the frames of a gif file by walking through its blocks, without decoding them.
+
+    Args:
+        filepath (`str`): The path to the animation file
+
+    Returns:
+        `int`: The number of frames, or `None` if the file is not a complete gif file
     """
-    #: A :class:`~GdkPixbuf.PixbufAnimation` containing all the frames and their timing for the displayed gif
+    try:
+        with open(filepath, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+
+    if data[:3] != b'GIF':
+        return None
+
+    try:
+        # Header and logical screen descriptor, then the optional global color table
+        pos = 13 + (3 << ((data[10] & 7) + 1) if data[10] & 0x80 else 0)
+        frames = 0
+        while data[pos] != 0x3B:
+            if data[pos] == 0x21:
+                # Extension: introducer and label
+                pos += 2
+            elif data[pos] == 0x2C:
+                # Image descriptor, optional local color table, and LZW minimum code size
+                frames += 1
+                pos += 11 + (3 << ((data[pos + 9] & 7) + 1) if data[pos + 9] & 0x80 else 0)
+            else:
+                return None
+
+            # Data sub-blocks, ending with an empty one
+            while data[pos]:
+                pos += data[pos] + 1
+            pos += 1
+    except IndexError:
+        return None
+
+    return frames
+
+
+class GifAnimation(object):
+    """ The frames of an animation, decoded once and shared by all the overlays showing it, which are redrawn by a
+    single clock.
+
+    Frames are kept as cairo surfaces scaled to the size at which they are drawn, as long as they fit in
+    :attr:`max_decoded_bytes` along with the decoded frames. Animations whose frames do not fit in
+    :attr:`max_decoded_bytes`, or whose frames can not be counted, are decoded as they play instead.
+
+    Args:
+        filepath (`str`): The path to the animation file
+    """
+    #: :class:`~weakref.WeakValueDictionary` of the animations in use, indexed by file path
+    _animations = weakref.WeakValueDictionary()
+    #: Maximum size in bytes of all the decoded and scaled frames of an animation
+    max_decoded_bytes = 64 << 20
+    #: Maximum number of sizes at which the frames are kept
+    max_sizes = 4
+
+    #: A :class:`~GdkPixbuf.PixbufAnimation` containing all the frames and their timing
     anim = None
-    #: A :class:`~GdkPixbuf.PixbufAnimationIter` which will provide the timely access to the frames in `~anim`
+    #: A :class:`~GdkPixbuf.PixbufAnimationIter` providing the frames when they are not all decoded, or `None`
     iter = None
     #: A `tuple` of (`int`, `int`) indicating the size of the bounding box of the gif
     base_size = None
-    #: The :class:`~cairo.Matrix` defining the zoom & shift to scale the gif
-    transform = None
+    #: `list` of :class:`~GdkPixbuf.Pixbuf`, the decoded frames, or the current frame only if they are not all decoded
+    frames = None
+    #: `list` of the display time of each frame in ms, -1 meaning forever
+    delays = None
+    #: :class:`~collections.OrderedDict` of `list` of :class:`~cairo.ImageSurface` (or `None`, when not scaled yet),
+    #: the frames scaled to the size used as key, most recently used last
+    surfaces = None
+    #: `int` the size in bytes of the scaled frames in :attr:`surfaces`
+    scaled_bytes = 0
+    #: `int` the index of the frame being shown
+    current = 0
+    #: `set` of the :class:`~pympress.media_overlays.gif_backend.GifOverlay` currently playing the animation
+    overlays = None
+    #: `int` identifying the :func:`~GLib.timeout_add` source advancing the frames, or 0
+    source = 0
+
+    def __init__(self, filepath):
+        self.anim = GdkPixbuf.PixbufAnimation.new_from_file(filepath)
+        self.base_size = (self.anim.get_width(), self.anim.get_height())
+        self.surfaces = collections.OrderedDict()
+        self.overlays = set()
+        self.decode(count_gif_frames(filepath))
+
+
+    @classmethod
+    def get(cls, filepath):
+        """ Get the animation for a file, decoding it if no overlay is using it yet.
+
+        Args:
+            filepath (`str`): The path to the animation file
+
+        Returns:
+            :class:`~pympress.media_overlays.gif_backend.GifAnimation`: The shared animation
+        """
+        animation = cls._animations.get(filepath)
+        if animation is None:
+            animation = cls._animations[filepath] = cls(filepath)
+        return animation
+
+
+    def decode(self, nb_frames):
+        """ Decode all the frames of the animation, if they fit in :attr:`max_decoded_bytes`.
+
+        Args:
+            nb_frames (`int`): The number of frames in the animation, or `None` if it is unknown
+        """
+        if self.anim.is_static_image():
+            self.frames, self.delays = [self.anim.get_static_image()], [-1]
+            return
+
+        if nb_frames and nb_frames * 4 * self.base_size[0] * self.base_size[1] <= self.max_decoded_bytes:
+            time = GLib.TimeVal()
+            anim_iter = self.anim.get_iter(time)
+            self.frames, self.delays = [], []
+
+            # Advancing by the delay of each frame reaches the next one
+            for n in range(nb_frames):
+                self.frames.append(anim_iter.get_pixbuf().copy())
+                self.delays.append(anim_iter.get_delay_time())
+                if self.delays[-1] < 0:
+                    break
+                time.add(self.delays[-1] * 1000)
+                anim_iter.advance(time)
+            return
+
+        logger.debug('Animation too large to be decoded in advance, or of unknown length, decoding it while playing')
+        self.iter = self.anim.get_iter(None)
+        self.frames, self.delays = [self.iter.get_pixbuf()], [self.iter.get_delay_time()]
+
+
+    def surface(self, width, height):
+        """ Get the current frame, scaled to fit in the given size while keeping its aspect ratio.
+
+        Args:
+            width (`int`): The width of the area where the frame is drawn
+            height (`int`): The height of the area where the frame is drawn
+
+        Returns:
+            :class:`~cairo.ImageSurface`: The scaled frame
+        """
+        scale = min(width / self.base_size[0], height / self.base_size[1])
+        size = (max(1, round(scale * self.base_size[0])), max(1, round(scale * self.base_size[1])))
+
+        if size in self.surfaces:
+            self.surfaces.move_to_end(size)
+        else:
+            self.surfaces[size] = [None] * len(self.frames)
+            while len(self.surfaces) > self.max_sizes:
+                self.drop_oldest_size()
+
+        scaled = self.surfaces[size]
+        if scaled[self.current] is None:
+            self.make_room(size)
+            surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, *size)
+            ctx = cairo.Context(surface)
+            ctx.scale(size[0] / self.base_size[0], size[1] / self.base_size[1])
+            Gdk.cairo_set_source_pixbuf(ctx, self.frames[self.current], 0, 0)
+            ctx.paint()
+            scaled[self.current] = surface
+            self.scaled_bytes += self.frame_bytes(size)
+
+        return scaled[self.current]
+
+
+    @staticmethod
+    def frame_bytes(size):
+        """ Compute the size in bytes of a frame scaled to a given size.
+
+        Args:
+            size (`tuple` of (`int`, `int`)): The size of the frame
+
+        Returns:
+            `int`: The size in bytes of the frame's surface
+        """
+        return cairo.ImageSurface.format_stride_for_width(cairo.FORMAT_ARGB32, size[0]) * size[1]
+
+
+    def drop_oldest_size(self):
+        """ Remove the frames scaled to the least recently used size.
+        """
+        size, dropped = self.surfaces.popitem(last=False)
+        self.scaled_bytes -= self.frame_bytes(size) * sum(surface is not None for surface in dropped)
+
+
+    def make_room(self, size):
+        """ Evict scaled frames until a frame of the given size fits in :attr:`max_decoded_bytes`.
+
+        The least recently used sizes are dropped first, then the other frames scaled at this size, in which case
+        frames are scaled again every time they are shown.
+
+        Args:
+            size (`tuple` of (`int`, `int`)): The size of the frame to be added
+        """
+        needed = len(self.frames) * 4 * self.base_size[0] * self.base_size[1] + self.frame_bytes(size)
+
+        # size is the most recently used, thus the last key
+        while len(self.surfaces) > 1 and self.scaled_bytes + needed > self.max_decoded_bytes:
+            self.drop_oldest_size()
+
+        if self.scaled_bytes + needed > self.max_decoded_bytes:
+            scaled = self.surfaces[size]
+            self.scaled_bytes -= self.frame_bytes(size) * sum(surface is not None for surface in scaled)
+            scaled[:] = [None] * len(scaled)
+
+
+    def start(self, overlay):
+        """ Start playing the animation in an overlay, from the first frame if it is the only one playing it.
+
+        Args:
+            overlay (:class:`~pympress.media_overlays.gif_backend.GifOverlay`): The overlay in which to play
+        """
+        if not self.overlays:
+            self.stop_clock()
+            if self.iter is not None:
+                self.iter = self.anim.get_iter(None)
+                self.load_current()
+            self.current = 0
+            self.schedule()
+
+        self.overlays.add(overlay)
+        overlay.movie_zone.queue_draw()
+
+
+    def stop(self, overlay):
+        """ Stop playing the animation in an overlay, and stop the clock if no overlay plays it any more.
+
+        Args:
+            overlay (:class:`~pympress.media_overlays.gif_backend.GifOverlay`): The overlay in which to stop
+        """
+        self.overlays.discard(overlay)
+        if not self.overlays:
+            self.stop_clock()
+
+
+    def stop_clock(self):
+        """ Remove the timeout advancing the frames, if any.
+        """
+        if self.source:
+            GLib.source_remove(self.source)
+            self.source = 0
+
+
+    def schedule(self):
+        """ Schedule showing the next frame, after the current frame's delay.
+        """
+        delay = self.delays[self.current]
+        if delay >= 0 and len(self.frames) + (self.iter is not None) > 1:
+            self.source = GLib.timeout_add(delay, self.advance)
+
+
+    def load_current(self):
+        """ Replace the current frame by the one of :attr:`iter`, for animations that are decoded while playing.
+        """
+        self.frames, self.delays = [self.iter.get_pixbuf()], [self.iter.get_delay_time()]
+        for size in self.surfaces:
+            self.surfaces[size] = [None]
+        self.scaled_bytes = 0
+
+
+    def advance(self):
+        """ Show the next frame in all the overlays playing the animation, and schedule the following one.
+
+        Returns:
+            `bool`: `True` iff this function should be run again (:func:`~GLib.timeout_add` convention)
+        """
+        if self.iter is not None:
+            if self.iter.advance(None):
+                self.load_current()
+        else:
+            self.current = (self.current + 1) % len(self.frames)
+
+        for overlay in self.overlays:
+            overlay.movie_zone.queue_draw()
+
+        self.schedule()
+        return False
+
+
+class GifOverlay(base.VideoOverlay):
+    """ A simple overlay mimicking the functionality of showing videos, but showing gifs instead.
+    """
+    #: The :class:`~pympress.media_overlays.gif_backend.GifAnimation` shown, shared with other overlays of the file
+    animation = None
 
     def __init__(self, container, show_controls, relative_margins, page_type, callback_getter):
         # override: no toolbar or interactive stuff for a gif, replace the whole widget area with a Gtk.Image
@@ -55,7 +337,6 @@ class GifOverlay(base.VideoOverlay):
 
         # we'll manually draw on the movie zone
         self.movie_zone.connect('draw', self.draw)
-        self.movie_zone.connect('configure-event', self.set_transform)
 
         # automatically show
         self.autoplay = True
@@ -67,54 +348,27 @@ class GifOverlay(base.VideoOverlay):
         Args:
             filepath (`str`): The path to the media file path
         """
-        self.anim = GdkPixbuf.PixbufAnimation.new_from_file(filepath)
-        self.base_size = (self.anim.get_width(), self.anim.get_height())
-        self.iter = self.anim.get_iter(None)
-
-        self.set_transform()
-        self.advance_gif()
-
-
-    def set_transform(self, *args):
-        """ Compute the transform to scale (not stretch nor crop) the gif.
-        """
-        widget_size = (self.movie_zone.get_allocated_width(), self.movie_zone.get_allocated_height())
-        scale = min(widget_size[0] / self.base_size[0], widget_size[1] / self.base_size[1])
-        dx = widget_size[0] - scale * self.base_size[0]
-        dy = widget_size[1] - scale * self.base_size[1]
-
-        self.transform = cairo.Matrix(xx = scale, yy = scale, x0 = dx / 2, y0 = dy / 2)
+        self.animation = GifAnimation.get(filepath)
 
 
     def draw(self, widget, ctx):
-        """ Simple resized drawing: get the pixbuf, set the transform, draw the image.
+        """ Simple resized drawing: get the frame scaled to the widget, draw it centered.
         """
-        if self.iter is None:
+        if self.animation is None:
             return False
 
+        ww, wh = widget.get_allocated_width(), widget.get_allocated_height()
         try:
-            ctx.transform(self.transform)
-            Gdk.cairo_set_source_pixbuf(ctx, self.iter.get_pixbuf(), 0, 0)
+            surface = self.animation.surface(ww, wh)
+            ctx.set_source_surface(surface, (ww - surface.get_width()) // 2, (wh - surface.get_height()) // 2)
             ctx.paint()
         except cairo.Error:
             logger.error(_('Cairo can not draw gif'), exc_info = True)
 
 
-    def advance_gif(self):
-        """ Advance the gif,  queue redrawing if the frame changed, and schedule the next frame.
-        """
-        if self.iter.advance():
-            self.movie_zone.queue_draw()
-
-        delay = self.iter.get_delay_time()
-        if delay >= 0:
-            GLib.timeout_add(delay, self.advance_gif)
-
-
     def do_set_time(self, t):
-        """ Set the player at time t.
-
-        Should run on the main thread to ensure we avoid vlc plugins' reentrency problems.
+        """ Start playing the animation. Gifs always start from the beginning, unless already playing in another
+        overlay, to stay in sync with it.
 
         Args:
             t (`int`): the timestamp, in ms
@@ -122,18 +376,20 @@ class GifOverlay(base.VideoOverlay):
         Returns:
             `bool`: `True` iff this function should be run again (:meth:`~GLib.idle_add` convention)
         """
-        start = GLib.TimeVal()
-        GLib.DateTime.new_now_local().to_timeval(start)
-        start.add(-t)
-        self.iter = self.anim.get_iter(start)
-        self.advance_gif()
+        self.animation.start(self)
         return False
 
 
+    def do_stop(self):
+        """ Stop redrawing this overlay with the animation.
+        """
+        if self.animation is not None:
+            self.animation.stop(self)
+
+
     # a bunch of inherited functions that do nothing, for gifs
     def mute(self, *args): pass
     def is_playing(self): return True
-    def do_stop(self): pass
     def do_play(self): return False
     def do_play_pause(self): return False
 
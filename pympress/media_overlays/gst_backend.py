@@ -32,17 +32,38 @@ import gi
 gi.require_version('Gtk', '3.0')
 gi.require_version('Gst', '1.0')
 gi.require_version('GstPlayer', '1.0')
-from gi.repository import GLib, Gst, GstPlayer
+gi.require_version('GstVideo', '1.0')
+from gi.repository import GLib, Gst, GstPlayer, GstVideo
 
 
 from pympress.util import IS_WINDOWS
 from pympress.media_overlays import base
 
 
+def window_handle(widget):
+    """ Get the native handle of the window of a widget, to embed a video sink.
+
+    Args:
+        widget (:class:`~Gtk.Widget`): A realized widget
+
+    Returns:
+        `int`: The XID or win32 handle of the widget's window
+    """
+    if IS_WINDOWS:
+        # TODO test in windows
+        # get_property('window')
+        return base.get_window_handle(widget.get_window())
+    else:
+        return widget.get_window().get_xid()
+
+
 class GstOverlay(base.VideoOverlay):
     """ Simple Gstramer widget.
 
     Its player can be controlled through the 'player' attribute, which is a :class:`~GstPlayer.Player` instance.
+
+    In shared decode mode, the content overlay is the leader of the presenter overlay: its player decodes the media
+    once, and a tee sends the frames to a video sink embedded in each of the two overlays.
     """
 
     #: A :class:`~GstPlayer.Player` to be play videos
@@ -54,10 +75,88 @@ class GstOverlay(base.VideoOverlay):
     # A :class:`~GstPlayer.PlayerState` representing the current state of the player
     player_state = GstPlayer.PlayerState.STOPPED
 
+    #: `str` URI of the media file
+    uri = None
+    #: `bool` that tracks whether the player should be muted
+    muted = False
+    #: `bool` that tracks whether the paused player should go back to the start before playing again
+    rewind = False
+    #: `bool` whether the player has played with a window to draw in, and thus may be paused instead of stopped
+    played = False
+
+    #: `bool` whether both overlays of a media are displayed from a single decoding pipeline
+    shared_decode = False
+    #: `bool` whether the frames sent to the presenter overlay are scaled down to its size in shared decode mode
+    downscale_presenter = True
+    #: `tuple` of names of video sink elements to try for shared decode mode, by order of preference
+    sink_names = ('d3dvideosink', 'autovideosink') if IS_WINDOWS else ('xvimagesink', 'ximagesink', 'glimagesink')
+
+    #: The :class:`~pympress.media_overlays.gst_backend.GstOverlay` whose player displays this overlay, or `None`
+    leader = None
+    #: The :class:`~pympress.media_overlays.gst_backend.GstOverlay` also displayed by this overlay's player, or `None`
+    follower = None
+    #: `tuple` of the video sinks (:class:`~Gst.Element`) for this overlay and its follower, in shared decode mode
+    sinks = None
+    #: The :class:`~Gst.Element` capsfilter setting the size of the frames sent to the follower, in shared decode mode
+    follower_caps = None
+
     def __init__(self, *args, **kwargs):
         super(GstOverlay, self).__init__(*args, **kwargs)
 
 
+    def share_decoder(self, follower):
+        """ Make this overlay's player display the follower overlay as well.
+
+        Args:
+            follower (:class:`~pympress.media_overlays.gst_backend.GstOverlay`): The overlay showing the same media
+        """
+        self.follower = follower
+        follower.leader = self
+
+
+    def make_video_sink(self):
+        """ Build the video sink of the shared decode pipeline: a tee to two sinks, the second one possibly downscaled.
+
+        Returns:
+            :class:`~Gst.Element`: The bin to use as the video sink of the player, or `None` if a Gstreamer plugin
+            providing one of its elements is missing
+        """
+        sink_bin = Gst.Bin.new('shared-video-sink')
+        tee = Gst.ElementFactory.make('tee')
+        if tee is None:
+            logger.error(_('Missing Gstreamer element {}').format('tee'))
+            return None
+        sink_bin.add(tee)
+        sink_bin.add_pad(Gst.GhostPad.new('sink', tee.get_static_pad('sink')))
+
+        sinks, caps = [], None
+        for with_caps in (False, self.downscale_presenter):
+            names = ['queue', 'videoconvert'] + (['videoscale', 'capsfilter'] if with_caps else [])
+            branch = [Gst.ElementFactory.make(name) for name in names]
+            branch.append(next(filter(None, (Gst.ElementFactory.make(name) for name in self.sink_names)), None))
+
+            missing = [name for name, element in zip(names + ['|'.join(self.sink_names)], branch) if element is None]
+            if missing:
+                logger.error(_('Missing Gstreamer element {}').format(', '.join(missing)))
+                return None
+
+            if with_caps:
+                caps = branch[-2]
+            sink = branch[-1]
+            sink.set_property('force-aspect-ratio', True)
+            sinks.append(sink)
+
+            for element in branch:
+                sink_bin.add(element)
+            tee.link(branch[0])
+            for src, dst in zip(branch[:-1], branch[1:]):
+                src.link(dst)
+
+        self.sinks = tuple(sinks)
+        self.follower_caps = caps
+        return sink_bin
+
+
     def track_state(self, player, state):
         """ Update the current state of the player for easy reference.
 
@@ -66,10 +165,42 @@ class GstOverlay(base.VideoOverlay):
             state (:class:`~GstPlayer.PlayerState`): The player's new state
         """
         self.player_state = state
-        if not self.is_playing() and self.renderer:
+        if self.follower is not None:
+            self.follower.player_state = state
+
+        # Only redraw in windows that still exist: hidden overlays have lost theirs
+        if self.is_playing():
+            pass
+        elif self.sinks is not None:
+            for sink, overlay in zip(self.sinks, (self, self.follower)):
+                if overlay.is_shown():
+                    GstVideo.VideoOverlay.expose(sink)
+        elif self.renderer and self.is_shown():
             self.renderer.expose()
 
 
+    def update_range(self, max_time):
+        """ Update the toolbar slider size, for this overlay and its follower.
+
+        Args:
+            max_time (`float`): The maximum time in this video in s
+        """
+        super(GstOverlay, self).update_range(max_time)
+        if self.follower is not None:
+            self.follower.update_range(max_time)
+
+
+    def update_progress(self, time):
+        """ Update the toolbar slider to the current time, for this overlay and its follower.
+
+        Args:
+            time (`float`): The time in this video in s
+        """
+        super(GstOverlay, self).update_progress(time)
+        if self.follower is not None:
+            self.follower.update_progress(time)
+
+
     def is_playing(self):
         """ Returns whether the media is currently playing (and not paused).
 
@@ -94,35 +225,79 @@ class GstOverlay(base.VideoOverlay):
         Args:
             value (`bool`): `True` iff this player should be muted
         """
+        if self.leader is not None:
+            # The shared pipeline plays the sound iff the presenter overlay would
+            return self.leader.mute(value)
+
         self.muted = value
+        if self.player is not None:
+            self.player.set_mute(value)
         return False
 
 
-    def do_play(self):
-        """ Start playing the media file.
+    def preload(self):
+        """ Build the player ahead of time, so that playing does not wait for the pipeline construction.
 
-        Returns:
-            `bool`: `True` iff this function should be run again (:func:`~GLib.idle_add` convention)
+        The pipeline is not prerolled: until the overlay is shown there is no window to draw in, and a video sink
+        without a window handle would open one of its own.
         """
-        self.renderer = GstPlayer.PlayerVideoOverlayVideoRenderer()
-        self.player = GstPlayer.Player.new(self.renderer)
+        if self.player is not None or self.leader is not None:
+            return
+
+        video_sink = self.make_video_sink() if self.follower is not None else None
+        if self.follower is not None and video_sink is None:
+            logger.warning('Can not share the decoding of {}, playing it in each window separately'.format(self.uri))
+            # The leader's muted state was the one of the follower, and the content overlay is always muted
+            self.follower.muted, self.muted = self.muted, True
+            self.follower.leader = None
+            self.follower = None
+
+        if video_sink is None:
+            self.renderer = GstPlayer.PlayerVideoOverlayVideoRenderer()
+            self.player = GstPlayer.Player.new(self.renderer)
+        else:
+            self.player = GstPlayer.Player.new(None)
+            self.player.get_pipeline().set_property('video-sink', video_sink)
+
         self.player.set_uri(self.uri)
         self.player.set_mute(self.muted)
 
         self.player.connect('state-changed', self.track_state)
-        self.player.connect('duration-changed', lambda p, ns: self.update_range(ns / 1e9))
+        self.player.connect('duration-changed', lambda p, ns: GLib.idle_add(self.update_range, ns / 1e9))
         self.player.connect('position-updated', lambda p, ns: self.update_progress(ns / 1e9))
         self.player.connect('end-of-stream', lambda e: GLib.idle_add(self.hide))
 
-        if self.renderer.get_window_handle():
-            pass
-        elif IS_WINDOWS:
-            # TODO test in windows
-            # get_property('window')
-            self.renderer.set_window_handle(base.get_window_handle(self.movie_zone.get_window()))
-        else:
-            self.renderer.set_window_handle(self.movie_zone.get_window().get_xid())
 
+    def do_play(self):
+        """ Start playing the media file.
+
+        Returns:
+            `bool`: `True` iff this function should be run again (:func:`~GLib.idle_add` convention)
+        """
+        if self.leader is not None:
+            return False
+
+        self.preload()
+
+        # The movie zones get a new window each time the overlays are shown
+        if self.sinks is None:
+            self.renderer.set_window_handle(window_handle(self.movie_zone))
+            self.played = True
+        else:
+            for sink, overlay in zip(self.sinks, (self, self.follower)):
+                if overlay.is_shown() and overlay.movie_zone.get_realized():
+                    GstVideo.VideoOverlay.set_window_handle(sink, window_handle(overlay.movie_zone))
+                    self.played = True
+
+            if self.follower_caps is not None:
+                # Only fix the width, videoscale then picks the height that keeps the aspect ratio
+                width = max(1, self.follower.movie_zone.get_allocated_width())
+                self.follower_caps.set_property('caps', Gst.Caps.from_string(
+                    'video/x-raw,width={},pixel-aspect-ratio=1/1'.format(width)))
+
+        if self.rewind:
+            self.rewind = False
+            self.player.seek(0)
         self.player.play()
         return False
 
@@ -135,16 +310,35 @@ class GstOverlay(base.VideoOverlay):
         Returns:
             `bool`: `True` iff this function should be run again (:func:`~GLib.idle_add` convention)
         """
-        self.player.pause() if self.is_playing() else self.player.play()
+        if self.player is not None:
+            self.player.pause() if self.is_playing() else self.player.play()
         return False
 
 
     def do_stop(self):
-        """ Stops playing in the backend player.
+        """ Stops playing in the backend player, keeping the pipeline paused and prerolled to play again.
+
+        The player goes back to the start when it plays next, once it has the window of the shown overlay again.
+        Players that never played in a window stay stopped, as pausing them would preroll without a window.
+        """
+        if self.player is not None and self.played:
+            self.player.pause()
+            self.rewind = True
+
+
+    def release(self):
+        """ Free the player and its pipeline.
         """
-        self.player.stop()
+        if self.player is not None:
+            self.player.stop()
         self.player = None
+        self.played = False
+        self.rewind = False
         self.renderer = None
+        self.sinks = None
+        self.follower_caps = None
+        self.leader = None
+        self.follower = None
 
 
     def do_set_time(self, t):
@@ -158,7 +352,9 @@ class GstOverlay(base.VideoOverlay):
         Returns:
             `bool`: `True` iff this function should be run again (:func:`~GLib.idle_add` convention)
         """
-        self.player.seek(int(t * 1e9))
+        if self.player is not None:
+            self.rewind = False
+            self.player.seek(int(t * 1e9))
         return False
 
 
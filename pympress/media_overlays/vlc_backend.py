@@ -56,7 +56,7 @@ class VlcOverlay(base.VideoOverlay):
         event_manager = self.player.event_manager()
         event_manager.event_attach(vlc.EventType.MediaPlayerEndReached, lambda e: GLib.idle_add(self.hide))
         event_manager.event_attach(vlc.EventType.MediaPlayerLengthChanged,
-                                   lambda e: self.update_range(self.player.get_length() / 1000. or 1.))
+                                   lambda e: GLib.idle_add(self.update_range, self.player.get_length() / 1000. or 1.))
         event_manager.event_attach(vlc.EventType.MediaPlayerTimeChanged,
                                    lambda e: self.update_progress(self.player.get_time() / 1000. or 1.))
 
@@ -131,6 +131,21 @@ class VlcOverlay(base.VideoOverlay):
         self.player.stop()
 
 
+    def preload(self):
+        """ Parse the media in the background, so that playing does not wait for the file to be opened.
+        """
+        media = self.player.get_media()
+        if media is not None and not media.is_parsed():
+            media.parse_with_options(vlc.MediaParseFlag.local, 0)
+
+
+    def release(self):
+        """ Free the native player.
+        """
+        self.player.stop()
+        self.player.release()
+
+
     def do_set_time(self, t):
         """ Set the player at time t.
 
@@ -79,8 +79,8 @@ class Pointer(object):
     #: a `dict` of the :class:`~Gtk.RadioMenuItem` selecting the pointer mode
     pointermode_radios = {}
 
-    #: callback, to be connected to :func:`~pympress.ui.UI.redraw_current_slide`
-    redraw_current_slide = lambda: None
+    #: callback, to be connected to :func:`~pympress.ui.UI.redraw_pointer`
+    redraw_pointer = lambda: None
 
     def __init__(self, config, builder):
         super(Pointer, self).__init__()
@@ -88,7 +88,7 @@ class Pointer(object):
 
         builder.load_widgets(self)
 
-        self.redraw_current_slide = builder.get_callback_handler('redraw_current_slide')
+        self.redraw_pointer = builder.get_callback_handler('redraw_pointer')
 
         default_mode = config.get('presenter', 'pointer_mode')
         default_color = 'pointer_' + config.get('presenter', 'pointer')
@@ -172,7 +172,7 @@ class Pointer(object):
             else:
                 extras.Cursor.set_cursor(slide_widget, 'parent')
 
-        self.redraw_current_slide()
+        self.redraw_pointer()
 
 
     def change_pointermode(self, widget):
@@ -194,19 +194,22 @@ class Pointer(object):
         self.pointermode_radios[mode.name.lower()].set_active(True)
 
 
-    def render_pointer(self, cairo_context, ww, wh):
-        """ Draw the laser pointer on screen.
+    def get_sprite(self, ww, wh):
+        """ Get the image of the laser pointer and where to draw it.
 
         Args:
-            cairo_context (:class:`~cairo.Context`): The canvas on which to render the pointer
             ww (`int`): The widget width
             wh (`int`): The widget height
+
+        Returns:
+            `tuple`: The :class:`~GdkPixbuf.Pixbuf` and the coordinates of its top left corner, or `None` if hidden
         """
-        if self.show_pointer:
-            x = ww * self.pointer_pos[0] - self.pointer.get_width() / 2
-            y = wh * self.pointer_pos[1] - self.pointer.get_height() / 2
-            Gdk.cairo_set_source_pixbuf(cairo_context, self.pointer, x, y)
-            cairo_context.paint()
+        if not self.show_pointer:
+            return None
+
+        x = ww * self.pointer_pos[0] - self.pointer.get_width() / 2
+        y = wh * self.pointer_pos[1] - self.pointer.get_height() / 2
+        return self.pointer, x, y
 
 
     def track_pointer(self, widget, event, point=None):
@@ -228,7 +231,7 @@ class Pointer(object):
             else:
                 ex, ey = event.get_coords()
                 self.pointer_pos = (ex / ww, ey / wh)
-            self.redraw_current_slide()
+            self.redraw_pointer()
             return True
 
         else:
@@ -260,7 +263,7 @@ class Pointer(object):
             self.show_pointer = False
             extras.Cursor.set_cursor(widget, 'parent')
 
-        self.redraw_current_slide()
+        self.redraw_pointer()
         return True
 
 
@@ -289,7 +292,7 @@ class Pointer(object):
         elif self.show_pointer and event.type == Gdk.EventType.BUTTON_RELEASE:
             self.show_pointer = False
             extras.Cursor.set_cursor(widget, 'parent')
-            self.redraw_current_slide()
+            self.redraw_pointer()
             return True
 
         else:
@@ -30,9 +30,11 @@ logger = logging.getLogger(__name__)
 
 import math
 import os
-import sympy
 import io
 import copy
+import json
+import pickle
+import collections
 
 import gi
 import cairo
@@ -40,7 +42,7 @@ gi.require_version('Gtk', '3.0')
 gi.require_version('PangoCairo', '1.0')
 from gi.repository import Gtk, Gdk, Pango, PangoCairo, GLib, GdkPixbuf
 
-from pympress import builder, extras, evdev_pad
+from pympress import builder, extras, evdev_pad, latex, util
 
 def ccw(A, B, C):
     """ Returns True if triangle ABC is counter clockwise
@@ -77,6 +79,98 @@ def bounding_rect(scribbles):
             add_point_rect_ordered(p, r)
     return r
 
+def point_segment_distance2(p, a, b):
+    """ Returns the square of the distance from point p to the line segment ab
+    """
+    dx, dy = b[0] - a[0], b[1] - a[1]
+    d2 = dx * dx + dy * dy
+    if d2 == 0:
+        t = 0
+    else:
+        t = max(0, min(1, ((p[0] - a[0]) * dx + (p[1] - a[1]) * dy) / d2))
+    ex, ey = a[0] + t * dx - p[0], a[1] + t * dy - p[1]
+    return ex * ex + ey * ey
+
+def simplify_points(points, tolerance):
+    """ Ramer-Douglas-Peucker simplification of a polyline.
+
+    Args:
+        points (`list`): the points of the stroke
+        tolerance (`float`): maximal distance, in page units, of a removed point to the simplified stroke
+
+    Returns:
+        `list`: the points that are kept, in order, always including the first and last ones
+    """
+    if tolerance <= 0 or len(points) < 3:
+        return points
+    tol2 = tolerance * tolerance
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    # Iterate instead of recursing, strokes from writing pads can be very long
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        dmax, index = 0, first
+        for i in range(first + 1, last):
+            d = point_segment_distance2(points[i], points[first], points[last])
+            if d > dmax:
+                dmax, index = d, i
+        if dmax > tol2:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [p for p, k in zip(points, keep) if k]
+
+def smooth_path(cairo_context, points):
+    """ Add to the context's path a smooth curve (Catmull-Rom spline) going through all the points
+    """
+    cairo_context.move_to(*points[0])
+    n = len(points)
+    for i in range(n - 1):
+        p0 = points[i - 1] if i > 0 else points[i]
+        p1, p2 = points[i], points[i + 1]
+        p3 = points[i + 2] if i + 2 < n else p2
+        cairo_context.curve_to(p1[0] + (p2[0] - p0[0]) / 6, p1[1] + (p2[1] - p0[1]) / 6,
+                               p2[0] - (p3[0] - p1[0]) / 6, p2[1] - (p3[1] - p1[1]) / 6,
+                               p2[0], p2[1])
+
+def has_pressure(points):
+    """ Returns True if all the points of a stroke carry a pressure value, as a third coordinate
+    """
+    return len(points) > 1 and all(len(p) > 2 for p in points)
+
+def pressure_outline(cairo_context, points, width):
+    """ Make the context's path the outline of a stroke whose width varies with the pressure at each point.
+
+    The outline is a single closed polygon with round caps, so that it can be filled in one operation.
+
+    Args:
+        cairo_context (:class:`~cairo.Context`): the context in which to build the path
+        points (`list`): the points of the stroke, in pixels, with the pressure (0..1) as third coordinate
+        width (`float`): the width of the stroke at full pressure, in pixels
+    """
+    n = len(points)
+    pts = [(p[0], p[1], width * (0.1 + 0.9 * min(max(p[2], 0), 1)) / 2) for p in points]
+    left, right, angles = [], [], []
+    for i in range(n):
+        x, y, r = pts[i]
+        dx = pts[min(i + 1, n - 1)][0] - pts[max(i - 1, 0)][0]
+        dy = pts[min(i + 1, n - 1)][1] - pts[max(i - 1, 0)][1]
+        angle = math.atan2(dx, -dy)
+        angles.append(angle)
+        left.append((x + r * math.cos(angle), y + r * math.sin(angle)))
+        right.append((x - r * math.cos(angle), y - r * math.sin(angle)))
+
+    cairo_context.new_path()
+    cairo_context.move_to(*left[0])
+    for p in left[1:]:
+        cairo_context.line_to(*p)
+    cairo_context.arc_negative(pts[-1][0], pts[-1][1], pts[-1][2], angles[-1], angles[-1] - math.pi)
+    for p in reversed(right):
+        cairo_context.line_to(*p)
+    cairo_context.arc_negative(pts[0][0], pts[0][1], pts[0][2], angles[0] + math.pi, angles[0])
+    cairo_context.close_path()
+
 def intersects(p0, p1, scribble):
     """ Returns true if the line segment intersect the scribble
     """
@@ -95,7 +189,8 @@ def intersects(p0, p1, scribble):
 
 def adjust_points(pts_l, dx, dy):
     for i in range(len(pts_l)):
-        pts_l[i] = [pts_l[i][0] + dx, pts_l[i][1] + dy]
+        # Keep extra coordinates, e.g. pressure
+        pts_l[i] = [pts_l[i][0] + dx, pts_l[i][1] + dy] + list(pts_l[i][2:])
 
 def adjust_scribbles(scribbles, dx, dy):
     for s in scribbles:
@@ -115,6 +210,24 @@ def is_text(scribble):
     except:
         return False
 
+def undo_op_size(op):
+    """ Returns a rough estimate of the memory held by an undo operation, in bytes
+    """
+    if op[0] == 'a':
+        scribbles = [op[1]]
+    elif op[0] in ('d', 'X', 'm'):
+        scribbles = op[1]
+    else:
+        scribbles = [x[0] for x in op[1]]
+    size = 64
+    for s in scribbles:
+        size += 200 + 64 * len(s[3])
+        if s[0] in ('image', 'latex'):
+            pixbuf = s[5] if s[0] == 'image' else s[6]
+            if isinstance(pixbuf, GdkPixbuf.Pixbuf):
+                size += pixbuf.get_byte_length()
+    return size
+
 def rgba_to_tuple(obj):
     return (obj.red, obj.green, obj.blue, obj.alpha)
 
@@ -160,7 +273,9 @@ class Scribbler(builder.Builder):
     track_clicks = lambda: None
 
     #: callback, to be connected to :func:`~pympress.ui.UI.redraw_current_slide`
-    redraw_current_slide = lambda: None
+    redraw_current_slide = lambda *args, **kwargs: None
+    #: callback, to be connected to :func:`~pympress.ui.UI.redraw_pointer`
+    redraw_pointer = lambda: None
 
     #: callback, to be connected to :func:`~pympress.extras.Zoom.get_slide_point`
     get_slide_point = lambda: None
@@ -178,6 +293,8 @@ class Scribbler(builder.Builder):
 
     #: position of the pen (writing pad) pointer (from UI class)
     pen_pointer = None
+    #: :class:`~GdkPixbuf.Pixbuf` of the pointer in the Presenter window, showing the current tool
+    pen_pointer_p = None
     #:
     pen_event = None
     have_pen = False
@@ -188,12 +305,40 @@ class Scribbler(builder.Builder):
     undo_stack = []
     #: Position in undo stack. Allows re-do
     undo_stack_pos = 0
+    #: Estimated memory held by the undo stack, in bytes
+    undo_size = 0
+    #: Page to which the undo stack belongs, `None` unless undo stacks are kept per page
+    undo_page = None
+    #: :class:`~collections.OrderedDict` of the undo stacks of pages not displayed, by page number, least
+    #: recently displayed first, as `list` of undo stack, position in undo stack and estimated memory
+    undo_histories = None
+    #: Maximum estimated memory held by all undo stacks, in bytes
+    max_undo_memory = 64 << 20
 
     selected = []
     select_rect = [[],[]]
     clipboard = None
 
     min_distance = 0
+    #: Tolerance (in page units) used to simplify freehand strokes when they are finished, 0 to disable
+    simplify_tolerance = 0
+    #: Whether to draw freehand strokes as smooth curves through their points, rather than polylines
+    smooth_strokes = False
+    #: :class:`~collections.OrderedDict` of outlines of pressure-sensitive strokes, as :class:`~cairo.Path`,
+    #: indexed by stroke and widget size, least recently used first
+    outline_cache = None
+    #: Maximum number of outlines kept in :attr:`outline_cache`
+    max_outlines = 2000
+    #: :class:`~collections.OrderedDict` of :class:`~Pango.Layout` of text scribbles, by text, font, markup and
+    #: resolution, least recently drawn first
+    layout_cache = None
+    #: Maximum number of cached text layouts
+    max_layouts = 500
+    #: :class:`~collections.OrderedDict` of :class:`~cairo.ImageSurface` of image and latex scribbles, at their
+    #: native size and at the size they were last drawn, least recently drawn first
+    image_cache = None
+    #: Maximum number of cached scaled images
+    max_images = 64
 
     scribble_font = "serif 16"
     font_size = 16
@@ -201,8 +346,17 @@ class Scribbler(builder.Builder):
     draw_blink = True
     text_alignment = 0
     show_text_frames = False
-    latex_dict = {}
-    latex_prefixes = set()
+    #: :class:`~pympress.latex.ShortcutTrie` of the typing shortcuts
+    latex_trie = None
+    #: :class:`~pympress.latex.LatexRenderer` compiling latex scribbles in the background
+    latex = None
+    #: Milliseconds without typing before compiling the latex being entered
+    latex_delay = 300
+    #: Source of the pending delayed latex compilation, or `None`
+    latex_timeout = None
+    latex_macros = {}
+    #: Whether the latex shortcuts and macros have been loaded, which is only done once text is first entered
+    latex_dicts_loaded = False
 
     stamps = {}
     stamp_names = []
@@ -218,6 +372,7 @@ class Scribbler(builder.Builder):
         self.track_motions = builder.get_callback_handler('track_motions')
         self.track_clicks = builder.get_callback_handler('track_clicks')
         self.redraw_current_slide = builder.get_callback_handler('redraw_current_slide')
+        self.redraw_pointer = builder.get_callback_handler('redraw_pointer')
         self.resize_cache = builder.get_callback_handler('cache.resize_widget')
         self.get_slide_point = builder.get_callback_handler('zoom.get_slide_point')
         self.start_zooming = builder.get_callback_handler('zoom.start_zooming')
@@ -239,35 +394,119 @@ class Scribbler(builder.Builder):
             self.have_pen = True
         self.pen_pointer = builder.pen_pointer
         self.min_distance = builder.min_distance
+        self.simplify_tolerance = config.getfloat('scribble', 'simplify_tolerance', fallback=0)
+        self.smooth_strokes = config.getboolean('scribble', 'smooth_strokes', fallback=False)
+        self.outline_cache = collections.OrderedDict()
+        self.undo_histories = collections.OrderedDict()
+        self.layout_cache = collections.OrderedDict()
+        self.image_cache = collections.OrderedDict()
+        self.latex = latex.LatexRenderer(config)
+        self.latex_delay = config.getint('scribble', 'latex_delay', fallback=300)
+        self.max_undo_memory = config.getfloat('scribble', 'undo_memory', fallback=64) * (1 << 20)
 
         self.read_stamps(config)
 
+    @classmethod
+    def offscreen(cls, config):
+        """ Build a scribbler that only renders scribbles, without any widget, e.g. for batch exports.
+
+        Args:
+            config (:class:`~pympress.config.Config`): A config object containing preferences
+
+        Returns:
+            :class:`~pympress.scribble.Scribbler`: a scribbler on which only :meth:`~render_scribbles` may be called
+        """
+        self = cls.__new__(cls)
+        self.config = config
+        # Never the widget passed to render_scribbles(), which is None
+        self.c_da = self.p_da_cur = False
+        self.smooth_strokes = config.getboolean('scribble', 'smooth_strokes', fallback=False)
+        self.outline_cache = collections.OrderedDict()
+        self.layout_cache = collections.OrderedDict()
+        self.image_cache = collections.OrderedDict()
+        self.latex = latex.LatexRenderer(config)
+        return self
+
+    def latex_resolution(self):
+        """ Get the resolution at which latex is compiled, the same on screen and in exports so that they share images.
+
+        Returns:
+            `int`: the resolution passed to dvipng
+        """
+        return 6 * self.font_size
+
     def latex_to_pixbuf(self, text, size, color, png=False):
-        # Rudimentary check for legal latex string:
-        if text.count("$") % 2 or \
-           text.count("\\begin") != text.count("\\end"):
-            return None
-        preamble = """ \\documentclass[varwidth,12pt]{standalone}
-            \\usepackage{amsmath,amsfonts,xcolor}
-            \\begin{document}
-            \\color[rgb]{%f,%f,%f}
-        """ % (color[0], color[1], color[2])
-        fn = "/tmp/ppl.png"
-        try:
-            #buf = io.BytesIO()
-            #sympy.preview(text, output='png', viewer='BytesIO', outputbuffer=buf,
-            #              dvioptions=["-T", "tight", "-z", "0", "--truecolor", "-D " + str(size)])
-            sympy.preview("\\color[rgb]{%f,%f,%f}\n%s" % (color[0], color[1], color[2], text),
-                          output='png', viewer="file", filename=fn, euler=False,
-                          preamble=preamble,
-                          dvioptions=["-T", "tight", "-z", "0", "--truecolor", "-D " + str(size)])
-            if png:
-                buf = open(fn,"rb").read()
-            else:
-                buf = GdkPixbuf.Pixbuf.new_from_file(fn)
-        except Exception as e:
-            return None
-        return buf
+        """ Get the image of a latex string, compiling it synchronously if needed.
+
+        Args:
+            text (`str`): the latex source
+            size (`int`): the resolution at which to render
+            color (`tuple`): the color of the text
+            png (`bool`): whether to return PNG data instead of a pixbuf
+
+        Returns:
+            `bytes` or :class:`~GdkPixbuf.Pixbuf`: the image, or `None` if the string does not compile
+        """
+        buf = self.latex.render(text, size, color)
+        return buf if png else latex.png_to_pixbuf(buf)
+
+    def prepare_latex(self, scribbles, callback):
+        """ Compile in the background the latex scribbles that have no image yet, e.g. before exporting them.
+
+        Args:
+            scribbles (`list`): the scribbles to render later on
+            callback (`function`): called on the main thread once all the images are in the cache
+        """
+        texts = {(s[5], tuple(s[1])) for s in scribbles if s[0] == 'latex' and s[5] and not s[6]}
+        if not texts:
+            callback()
+            return
+
+        remaining = [len(texts)]
+
+        def compiled(png):
+            remaining[0] -= 1
+            if not remaining[0]:
+                callback()
+
+        for text, color in texts:
+            self.latex.render_async(text, self.latex_resolution(), color, compiled)
+
+    def request_latex(self, scribble, delay=0):
+        """ Compile the text of a latex scribble in the background, and show its image once it is ready.
+
+        Args:
+            scribble (`list`): the latex scribble
+            delay (`int`): milliseconds to wait for further changes to the text before compiling
+        """
+        scribble[7] = scribble[5]
+        if not delay:
+            self.compile_latex(scribble)
+            return
+
+        if self.latex_timeout is not None:
+            GLib.source_remove(self.latex_timeout)
+        self.latex_timeout = GLib.timeout_add(delay, self.compile_latex, scribble, True)
+
+    def compile_latex(self, scribble, delayed=False):
+        """ Start compiling the text of a latex scribble, swapping its image in when done.
+
+        Args:
+            scribble (`list`): the latex scribble
+            delayed (`bool`): whether this is called from the delayed compilation timeout
+        """
+        if delayed:
+            self.latex_timeout = None
+        text = scribble[5]
+
+        def swap(png):
+            # Results for outdated text are superseded by a later request
+            if scribble[5] == text:
+                scribble[6] = latex.png_to_pixbuf(png)
+                self.redraw_current_slide('scribble')
+
+        self.latex.render_async(text, self.latex_resolution(), scribble[1], swap)
+        return False
 
 
     def evdev_callback_buttons(self, name):
@@ -278,6 +517,41 @@ class Scribbler(builder.Builder):
         self.track_scribble(point, (False, 0))
         return False
 
+    def evdev_schedule_drain(self):
+        """ Drain the samples buffered by the pen thread at the next frame, rather than once per sample.
+
+        Without a frame clock ticking, e.g. when the presenter window is not mapped, drain them right away. A timeout
+        also drains them in case the frame clock stops before ticking, as draining twice is harmless.
+        """
+        if self.p_da_cur.get_mapped():
+            self.p_da_cur.add_tick_callback(self.evdev_drain)
+            GLib.timeout_add(100, self.evdev_drain)
+        else:
+            self.evdev_drain()
+        return False
+
+    def evdev_drain(self, *args):
+        """ Feed all the pen samples and button changes buffered since the last frame to the scribbling, in order,
+        then redraw once.
+
+        Returns:
+            `bool`: `False`, so that the tick callback is removed until new samples arrive
+        """
+        events, pointer = self.pen_event.pop_samples()
+        points = False
+        for button, point in events:
+            if button is not None:
+                self.evdev_callback_track(button)
+            else:
+                self.track_scribble(point, (False, 0), redraw=False)
+                points = True
+        if pointer:
+            self.set_pointer(pointer)
+        elif points:
+            # Usually in a tick of the frame clock already: draw in this frame rather than the next
+            self.redraw_current_slide('scribble', now=True)
+        return False
+
     def evdev_callback_pointer(self, point):
         self.set_pointer(point)
         return False
@@ -373,9 +647,66 @@ class Scribbler(builder.Builder):
             return False
         return True
 
+    def load_latex_dicts(self):
+        """ Load the latex shortcuts and the personal macros, the first time they are needed.
+
+        The shortcuts are compiled to a :class:`~pympress.latex.ShortcutTrie`, which is cached on disk along with the
+        macros until either dictionary file changes.
+        """
+        if self.latex_dicts_loaded:
+            return
+        self.latex_dicts_loaded = True
+
+        sources = [util.get_latex_dict(), util.get_personal_dict()]
+        stamp = [(os.path.getmtime(f), os.path.getsize(f)) if os.path.isfile(f) else None for f in sources]
+        try:
+            cache_file = os.path.join(util.get_cache_dir('latex'), 'shortcuts.pickle')
+        except OSError:
+            cache_file = None
+
+        try:
+            with open(cache_file, 'rb') as f:
+                cached = pickle.load(f)
+            if cached['sources'] == sources and cached['stamp'] == stamp:
+                self.latex_trie, self.latex_macros = cached['trie'], cached['macros']
+                return
+        except Exception:
+            pass
+
+        latex_dict = json.load(open(sources[0]))
+        self.latex_macros = {
+            "latex": { "ctrl": {}, "alt": {}, "altctrl": {}, },
+            "markup": { "ctrl": {}, "alt": {}, "altctrl": {}, },
+            "text": { "ctrl": {}, "alt": {}, "altctrl": {}, },
+        }
+        try:
+            personal_dict = json.load(open(sources[1]))
+            latex_dict.update(personal_dict['shortcuts'])
+            for dicts in self.latex_macros.keys():
+                for m in personal_dict[dicts].keys():
+                    for k, v in personal_dict[dicts][m].items():
+                        p = v.find("\f")
+                        if p == -1:
+                            p = len(v)
+                        self.latex_macros[dicts][m][k] = (v.replace("\f", ""), p)
+        except FileNotFoundError:
+            pass
+        except KeyError:
+            pass
+        self.latex_trie = latex.ShortcutTrie(latex_dict)
+
+        if cache_file is not None:
+            try:
+                with open(cache_file, 'wb') as f:
+                    pickle.dump({'sources': sources, 'stamp': stamp, 'trie': self.latex_trie,
+                                 'macros': self.latex_macros}, f, pickle.HIGHEST_PROTOCOL)
+            except OSError as e:
+                logger.warning('Can not cache latex shortcuts: {}'.format(e))
+
     def key_entered(self, val, s, state):
         if not self.text_entry or not self.scribble_list or not is_text(self.text_entry):
             return False
+        self.load_latex_dicts()
         mode = self.text_entry[0]
         macros = mode
         if mode == "text" and self.text_entry[5] and self.text_entry[5][0] == '\0':
@@ -425,14 +756,20 @@ class Scribbler(builder.Builder):
         elif (31 < val < 65280 or val in (Gdk.KEY_Return, )) and s and not state & (Gdk.ModifierType.CONTROL_MASK | Gdk.ModifierType.MOD1_MASK):
             self.text_entry[5] = self.text_entry[5][:pos] + s + self.text_entry[5][pos:]
             pos = pos + 1
-            i = self.text_entry[5].rfind('\\', 0, pos - 1) if shortcuts else -2
+            # No shortcut (nor \\uXXXXXX character code) is longer than this: no need to look further back
+            lookback = max(self.latex_trie.depth, 8) + 2
+            i = self.text_entry[5].rfind('\\', max(0, pos - lookback), pos - 1) if shortcuts else -2
             if i > -1:
-                if self.text_entry[5][i+1:pos] in self.latex_dict:
-                    if self.text_entry[5][i+1:pos] not in self.latex_prefixes:
-                        self.text_entry[5] = self.text_entry[5][:i] + self.latex_dict[self.text_entry[5][i+1:pos]] + self.text_entry[5][pos:]
+                replacement, more = self.latex_trie.lookup(self.text_entry[5][i+1:pos])
+                shorter = None
+                if replacement is None and not self.text_entry[5][pos-1].isalpha():
+                    shorter = self.latex_trie.lookup(self.text_entry[5][i+1:pos-1])[0]
+                if replacement is not None:
+                    if not more:
+                        self.text_entry[5] = self.text_entry[5][:i] + replacement + self.text_entry[5][pos:]
                         pos = i + 1
-                elif not self.text_entry[5][pos-1].isalpha() and self.text_entry[5][i+1:pos-1] in self.latex_dict:
-                    self.text_entry[5] = self.text_entry[5][:i] + self.latex_dict[self.text_entry[5][i+1:pos-1]] + self.text_entry[5][pos-1:]
+                elif shorter is not None:
+                    self.text_entry[5] = self.text_entry[5][:i] + shorter + self.text_entry[5][pos-1:]
                     pos = i + 2
                 elif i < len(self.text_entry[5]) - 3 and self.text_entry[5][i+1] == 'u':
                     if self.text_entry[5][-1].lower() not in "0123456789abcdef":
@@ -453,17 +790,19 @@ class Scribbler(builder.Builder):
             #logger.debug(f"unknown key, {val=}, {s=}, name={Gdk.keyval_name(val)}")
             pass
         if mode == "latex" and self.text_entry[7] != self.text_entry[5]:
-            self.text_entry[6] = self.latex_to_pixbuf(self.text_entry[5], 6 * self.font_size, self.scribble_color)
-            self.text_entry[7] = self.text_entry[5]
-        self.redraw_current_slide()
+            self.request_latex(self.text_entry, self.latex_delay)
+        self.redraw_current_slide('scribble')
         self.text_pos = pos
         return True
 
     def read_stamps(self, config):
+        """ Read the stamps from the configuration. Their images are only loaded or rendered when first used.
+
+        Args:
+            config (:class:`~pympress.config.Config`): A config object containing preferences
+        """
         if 'stamps' in config:
-            iconw, iconh = 32, 32
             for name in config['stamps']:
-                self.stamp_names.append(name)
                 stamp_str = self.config.get('stamps', name)
                 p = stamp_str.split(':')
                 if stamp_str.startswith('/') and os.path.isfile(stamp_str):
@@ -471,14 +810,8 @@ class Scribbler(builder.Builder):
                         'name': name,
                         'type': 'image',
                         'color': self.scribble_color,
+                        'path': stamp_str,
                     }
-                    self.stamps[name]['image'] = Gtk.Image().new_from_file(stamp_str)
-                    self.stamps[name]['pixbuf'] = self.stamps[name]['image'].get_pixbuf()
-                    w, h = self.stamps[name]['pixbuf'].get_width(), self.stamps[name]['pixbuf'].get_height()
-                    if w > iconw or h > iconh:
-                        scale = min(iconw/w, iconh/h)
-                        self.stamps[name]['image'].set_from_pixbuf(
-                            self.stamps[name]['pixbuf'].scale_simple(w*scale, h*scale, GdkPixbuf.InterpType.BILINEAR) )
                 elif len(p) == 3:
                     color = Gdk.RGBA()
                     color.parse(p[0])
@@ -489,34 +822,79 @@ class Scribbler(builder.Builder):
                         'font': p[1],
                         'str': p[2],
                     }
-                    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, iconw, iconh)
-                    cairo_ctx = cairo.Context(surface)
-                    cairo_ctx.set_source_rgb(1.0, 1.0, 1.0)
-                    cairo_ctx.paint()
-                    layout = PangoCairo.create_layout(cairo_ctx)
-                    layout.set_text(self.stamps[name]['str'])
-                    desc = Pango.FontDescription(self.stamps[name]['font'])
-                    layout.set_font_description(desc)
-                    cairo_ctx.set_source_rgba(*self.stamps[name]['color'])
-                    PangoCairo.update_layout(cairo_ctx, layout)
-                    w = layout.get_size()[0] / Pango.SCALE
-                    h = layout.get_size()[1] / Pango.SCALE
-                    cairo_ctx.move_to((iconw - w) / 2, (iconh - h) / 2)
-                    PangoCairo.show_layout(cairo_ctx, layout)
-                    self.stamps[name]['surface'] = surface
-                    b = surface.get_data()
-                    # Convert from BGRA (Cairo) to RGBA (Gdk)
-                    for i in range(0, len(b), 4):
-                        b[i], b[i+2] = b[i+2],b[i]
-                    pixbuf = GdkPixbuf.Pixbuf.new_from_data(b, GdkPixbuf.Colorspace.RGB, True, 8, iconw, iconh, 128)
-                    self.stamps[name]['image'] = Gtk.Image.new_from_pixbuf(pixbuf)
+                else:
+                    logger.warning('Can not understand stamp {} = {}'.format(name, stamp_str))
+                    continue
+                self.stamp_names.append(name)
+
+    def stamp_source(self, stamp):
+        """ Get the full size image of an image stamp, loading it on first use.
+
+        Args:
+            stamp (`dict`): The stamp
+
+        Returns:
+            :class:`~GdkPixbuf.Pixbuf`: the image, or `None` if it can not be loaded
+        """
+        if 'pixbuf' not in stamp:
+            try:
+                stamp['pixbuf'] = GdkPixbuf.Pixbuf.new_from_file(stamp['path'])
+            except GLib.Error as e:
+                logger.warning('Can not load stamp {}: {}'.format(stamp['name'], e))
+                stamp['pixbuf'] = None
+        return stamp['pixbuf']
+
+    def stamp_icon(self, stamp, size=32):
+        """ Get the icon of a stamp, rendered on first use and cached for each size.
+
+        Args:
+            stamp (`dict`): The stamp
+            size (`int`): The maximum width and height of the icon
+
+        Returns:
+            :class:`~GdkPixbuf.Pixbuf`: the icon, or `None` if the stamp image can not be loaded
+        """
+        icons = stamp.setdefault('icons', {})
+        if size in icons:
+            return icons[size]
+
+        if stamp['type'] == 'image':
+            pixbuf = self.stamp_source(stamp)
+            if pixbuf is not None:
+                w, h = pixbuf.get_width(), pixbuf.get_height()
+                if w > size or h > size:
+                    scale = min(size / w, size / h)
+                    pixbuf = pixbuf.scale_simple(max(1, int(w * scale)), max(1, int(h * scale)),
+                                                 GdkPixbuf.InterpType.BILINEAR)
+        else:
+            surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, size, size)
+            cairo_ctx = cairo.Context(surface)
+            cairo_ctx.set_source_rgb(1.0, 1.0, 1.0)
+            cairo_ctx.paint()
+            layout = PangoCairo.create_layout(cairo_ctx)
+            layout.set_text(stamp['str'])
+            layout.set_font_description(Pango.FontDescription(stamp['font']))
+            cairo_ctx.set_source_rgba(*stamp['color'])
+            PangoCairo.update_layout(cairo_ctx, layout)
+            w = layout.get_size()[0] / Pango.SCALE
+            h = layout.get_size()[1] / Pango.SCALE
+            cairo_ctx.move_to((size - w) / 2, (size - h) / 2)
+            PangoCairo.show_layout(cairo_ctx, layout)
+            surface.flush()
+            # Gdk converts from cairo's premultiplied BGRA to RGBA in one go
+            pixbuf = Gdk.pixbuf_get_from_surface(surface, 0, 0, size, size)
+
+        icons[size] = pixbuf
+        return pixbuf
 
     def set_stamp(self, name=None):
         if name not in self.stamps:
             self.stamp = self.stamps[self.stamp_names[0]]
         else:
             self.stamp = self.stamps[name]
-        image = self.stamp['image']
+        image = self.stamp.get('image')
+        if image is None:
+            image = self.stamp['image'] = Gtk.Image.new_from_pixbuf(self.stamp_icon(self.stamp))
         image.show()
         self.buttons["stamp"].set_icon_widget(image)
 
@@ -527,13 +905,16 @@ class Scribbler(builder.Builder):
             self.set_stamp(l[i + 1]['name'])
         except (ValueError, IndexError):
             self.set_stamp()
-        self.redraw_current_slide()
+        self.redraw_current_slide('scribble')
 
     def stamp_scribble(self, point, stamp=None):
         if not stamp:
             stamp = self.stamp
         if stamp['type'] == 'image':
-            return ["image", stamp['color'], self.scribble_width, [point], [[0, 0], [0, 0]], stamp['pixbuf'], stamp['name']]
+            pixbuf = self.stamp_source(stamp)
+            if pixbuf is None:
+                return None
+            return ["image", stamp['color'], self.scribble_width, [point], [[0, 0], [0, 0]], pixbuf, stamp['name']]
         elif stamp['type'] == 'text':
             return ["text", stamp['color'], self.scribble_width, [point], [[0, 0], [0, 0]], stamp['str'], stamp['font'], 0]
         return None
@@ -589,38 +970,39 @@ class Scribbler(builder.Builder):
 
     def select_all(self):
         self.selected = self.scribble_list[:]
-        self.redraw_current_slide()
+        self.redraw_current_slide('scribble')
 
     def select_none(self):
         self.selected = []
-        self.redraw_current_slide()
+        self.redraw_current_slide('scribble')
 
     def select_toggle(self):
         if self.selected:
             self.selected = []
         else:
             self.selected = self.scribble_list[:]
-        self.redraw_current_slide()
+        self.redraw_current_slide('scribble')
 
     def del_selected(self):
         self.add_undo(('d', self.selected))
         for scribble in self.selected:
             self.scribble_list.remove(scribble)
         self.selected = []
-        self.redraw_current_slide()
+        self.redraw_current_slide('scribble')
 
     def set_pointer(self, point):
         if self.have_pen and self.pen_pointer is not None and point:
             # The event thread might start running a bit too early
             self.pen_pointer[0] = point
-            self.redraw_current_slide()
+            self.redraw_pointer()
 
-    def track_scribble(self, point, button):
+    def track_scribble(self, point, button, redraw=True):
         """ Draw the scribble following the mouse's moves.
 
         Args:
             point: point on slide where event occured (self.zoom.get_slide_point(widget, event))
             button: button code (event.get_button())
+            redraw (`bool`): whether to queue a redraw, `False` when the caller redraws once after a batch of points
 
         Returns:
             `bool`: whether the event was consumed
@@ -628,6 +1010,7 @@ class Scribbler(builder.Builder):
         if self.scribble_drawing:
             if self.have_pen and self.pen_pointer is not None:
                 self.pen_pointer[0] = point
+                self.redraw_pointer()
             if button[0]:
                 self.drag_button = button[1]
             if self.drawing_mode == "draw" and self.drag_button == Gdk.BUTTON_PRIMARY:
@@ -639,9 +1022,10 @@ class Scribbler(builder.Builder):
                 if self.scribble_list[-1][3]:
                     add_point_rect_ordered(point, self.scribble_list[-1][4])
                 else:
-                    self.scribble_list[-1][4]=[list(point),list(point)]
+                    self.scribble_list[-1][4]=[list(point[:2]),list(point[:2])]
                 self.scribble_list[-1][3].append(point)
-                self.redraw_current_slide()
+                if redraw:
+                    self.redraw_current_slide('scribble')
             elif self.drawing_mode == "erase" or (
                  self.drawing_mode == "draw" and self.drag_button == Gdk.BUTTON_SECONDARY):
                 for scribble in self.scribble_list[:]:
@@ -649,11 +1033,14 @@ class Scribbler(builder.Builder):
                         self.add_undo(('d', [scribble]))
                         self.scribble_list.remove(scribble)
                 self.last_del_point = point
-                self.redraw_current_slide()
+                if redraw:
+                    self.redraw_current_slide('scribble')
             elif self.drawing_mode in ("box", "line", "ellipse"):
-                self.scribble_list[-1][3][1] = point
-                add_point_rect_ordered(point, self.scribble_list[-1][4])
-                self.redraw_current_slide()
+                # Only freehand strokes have a width varying with the pressure
+                self.scribble_list[-1][3][1] = point[:2]
+                add_point_rect_ordered(point[:2], self.scribble_list[-1][4])
+                if redraw:
+                    self.redraw_current_slide('scribble')
             elif self.drawing_mode == "select_t":
                 for scribble in self.scribble_list[:]:
                     if scribble not in self.stroke_selected and intersects(self.last_del_point, point, scribble):
@@ -663,7 +1050,8 @@ class Scribbler(builder.Builder):
                         else:
                             self.selected.append(scribble)
                 self.last_del_point = point
-                self.redraw_current_slide()
+                if redraw:
+                    self.redraw_current_slide('scribble')
             elif self.drawing_mode == "select_r":
                 self.select_rect[1] = list(point)
                 self.selected = []
@@ -685,7 +1073,8 @@ class Scribbler(builder.Builder):
                                 self.select_rect[0][1] <= p[1] <= self.select_rect[1][1]):
                                 self.selected.append(scribble)
                                 break
-                self.redraw_current_slide()
+                if redraw:
+                    self.redraw_current_slide('scribble')
             elif self.drawing_mode == "move":
                 dx = point[0] - self.last_del_point[0]
                 dy = point[1] - self.last_del_point[1]
@@ -696,7 +1085,8 @@ class Scribbler(builder.Builder):
                 self.undo_stack[-1][3] = point[1] - self.move_from[1]
                 adjust_scribbles(self.selected, dx, dy)
                 adjust_points(self.select_rect, dx, dy)
-                self.redraw_current_slide()
+                if redraw:
+                    self.redraw_current_slide('scribble')
         else:
             if self.drawing_mode == "stamp":
                 self.stamp_point = point
@@ -704,6 +1094,20 @@ class Scribbler(builder.Builder):
         return False
 
 
+    def commit_stroke(self, scribble):
+        """ Simplify a freehand stroke once it is finished, to store and draw fewer points.
+
+        Args:
+            scribble (`list`): the segment scribble that was just drawn
+        """
+        if scribble[0] != "segment" or self.simplify_tolerance <= 0 or len(scribble[3]) < 3:
+            return
+        scribble[3] = simplify_points(scribble[3], self.simplify_tolerance)
+        scribble[4] = [list(scribble[3][0][:2]), list(scribble[3][0][:2])]
+        for p in scribble[3][1:]:
+            add_point_rect_ordered(p, scribble[4])
+
+
     def toggle_scribble(self, widget, e_type, point, button, always=False, state=0):
         """ Start/stop drawing scribbles.
 
@@ -731,11 +1135,15 @@ class Scribbler(builder.Builder):
                     elif scribble[0] == "latex":
                         self.enable_latex()
                     self.scribble_drawing = True
-                    self.redraw_current_slide()
+                    self.redraw_current_slide('scribble')
                     return True
             return False
 
         if e_type == Gdk.EventType.BUTTON_PRESS:
+            if self.drawing_mode in ("box", "line", "ellipse"):
+                # Only freehand strokes have a width varying with the pressure
+                point = point[:2]
+
             if self.drawing_mode == "draw" and button[1] == Gdk.BUTTON_PRIMARY:
                 self.scribble_list.append(["segment", self.scribble_color, self.scribble_width, [],[]])
                 self.add_undo(('a', self.scribble_list[-1]))
@@ -794,7 +1202,7 @@ class Scribbler(builder.Builder):
                 if s:
                     self.scribble_list.append(s)
                     self.add_undo(('a', self.scribble_list[-1]))
-                    self.redraw_current_slide()
+                    self.redraw_current_slide('scribble')
                 return True
             self.scribble_drawing = True
             return self.track_scribble(point, button)
@@ -815,10 +1223,13 @@ class Scribbler(builder.Builder):
                     self.scribble_list[-1][3][1][0], self.scribble_list[-1][3][1][1]])
             if self.drawing_mode in ["box", "ellipse"]:
                 self.scribble_list[-1][4] = [x[:] for x in self.scribble_list[-1][3]]
+            if self.drawing_mode == "draw" and self.drag_button == Gdk.BUTTON_PRIMARY:
+                self.commit_stroke(self.scribble_list[-1])
 
             self.scribble_drawing = False
             if self.have_pen and self.pen_pointer is not None:
                 self.pen_pointer[0] = []
+                self.redraw_pointer()
             return True
 
         return False
@@ -832,9 +1243,6 @@ class Scribbler(builder.Builder):
             cairo_context (:class:`~cairo.Context`): The canvas on which to render the drawings
         """
         ww, wh = widget.get_allocated_width(), widget.get_allocated_height()
-        pixels_per_point = ww/pw
-
-        cairo_context.set_line_cap(cairo.LINE_CAP_ROUND)
 
         if draw_selected or self.drawing_mode not in ("select_t", "select_r", "move"):
             scribbles_to_draw = self.scribble_list[:]
@@ -846,20 +1254,68 @@ class Scribbler(builder.Builder):
             if s:
                 scribbles_to_draw.append(s)
 
-        for scribble in scribbles_to_draw:
+        self.render_scribbles(cairo_context, scribbles_to_draw, ww, wh, pw, widget)
+
+        if widget is self.p_da_cur and self.select_rect[1]:
+                points = [(p[0] * ww, p[1] * wh) for p in self.select_rect]
+                x0, y0 = points[0]
+                x1, y1 = points[1]
+                cairo_context.move_to(x0, y0)
+                cairo_context.line_to(x0, y1)
+                cairo_context.line_to(x1, y1)
+                cairo_context.line_to(x1, y0)
+                cairo_context.close_path()
+                cairo_context.set_source_rgba(0.3,0.3,0.3,0.8)
+                cairo_context.set_line_width(2)
+                cairo_context.set_dash([5,5,5])
+                cairo_context.stroke()
+
+    def render_scribbles(self, cairo_context, scribbles, ww, wh, pw, widget=None):
+        """ Render scribbles on a canvas.
+
+        Args:
+            cairo_context (:class:`~cairo.Context`): The canvas on which to render the drawings
+            scribbles (`list`): The scribbles to render
+            ww (`float`): The width of the canvas
+            wh (`float`): The height of the canvas
+            pw (`float`): The width of the page, in points
+            widget (:class:`~Gtk.DrawingArea`): The widget where to draw the scribbles, or `None` when exporting
+        """
+        pixels_per_point = ww/pw
+        # Only the clipped area is redrawn, e.g. around a moving pointer: skip the shapes outside of it
+        cx0, cy0, cx1, cy1 = cairo_context.clip_extents()
+
+        cairo_context.set_line_cap(cairo.LINE_CAP_ROUND)
+
+        for scribble in scribbles:
             stype, color, pwidth, points, rect, *extra = scribble
             width = pwidth * pixels_per_point
-            if stype == "segment":
+            if stype in ("segment", "box", "ellipse") and len(rect) == 2:
+                (rx0, ry0), (rx1, ry1) = rect[0][:2], rect[1][:2]
+                margin = 2 * width + 1
+                if min(rx0, rx1) * ww - margin > cx1 or max(rx0, rx1) * ww + margin < cx0 or \
+                        min(ry0, ry1) * wh - margin > cy1 or max(ry0, ry1) * wh + margin < cy0:
+                    continue
+
+            # Freehand strokes only: lines have no pressure, and arrows have a sixth element
+            if stype == "segment" and len(scribble) == 5 and has_pressure(points):
+                cairo_context.set_source_rgba(*color)
+                cairo_context.append_path(self.get_outline(scribble, ww, wh, width))
+                cairo_context.fill()
+            elif stype == "segment":
                 points = [(p[0] * ww, p[1] * wh) for p in points]
 
                 cairo_context.set_source_rgba(*color)
                 cairo_context.set_line_width(width)
                 cairo_context.set_dash([])
-                if points:
-                    cairo_context.move_to(*points[0])
+                if self.smooth_strokes and len(points) > 2 and len(scribble) == 5:
+                    smooth_path(cairo_context, points)
+                else:
+                    if points:
+                        cairo_context.move_to(*points[0])
 
-                for p in points[1:]:
-                    cairo_context.line_to(*p)
+                    for p in points[1:]:
+                        cairo_context.line_to(*p)
                 cairo_context.stroke()
             elif stype == "box":
                 points = [(p[0] * ww, p[1] * wh) for p in points]
@@ -902,10 +1358,7 @@ class Scribbler(builder.Builder):
                 # Markup mode is when text starts with '\0'.
                 # The actual text is always displayed on presenter, but on content it is replaced by rendered latex, or pango markup.
                 # Perhaps it is better to separate to three different paths (or more).
-                layout = PangoCairo.create_layout(cairo_context)
-                PangoCairo.context_set_resolution(layout.get_context(), 72 * pixels_per_point)
                 font = extra[1] if stype == "text" else "Roboto Mono Bold 12"
-                layout.set_font_description(Pango.FontDescription(font))
                 if extra[0] and extra[0][0] == '\0':
                     markup = True
                     text = extra[0][1:]
@@ -921,13 +1374,7 @@ class Scribbler(builder.Builder):
                     i = text.rfind('\\', 0, -1)
                     if i > -1 and (i == len(text) - 1 or (i < len(text) - 1 and text[i+1].isalnum())):
                         text = text[:i]
-                if markup:
-                    if widget is self.c_da:
-                        layout.set_markup(text)
-                    else:
-                        layout.set_text(text)
-                else:
-                    layout.set_text(text)
+                layout = self.get_layout(cairo_context, text, font, markup and widget is not self.p_da_cur, pixels_per_point)
                 if stype == "text":
                     cairo_context.set_source_rgba(*color)
                 else:
@@ -984,21 +1431,33 @@ class Scribbler(builder.Builder):
                 cairo_context.stroke()
             if stype in ["image", "latex"]:
                 pixbuf = extra[0] if stype == "image" else extra[1]
-                if not pixbuf and stype == "latex" and extra[0] != extra[2]:
-                    scribble[6] = self.latex_to_pixbuf(extra[0], 6 * self.font_size, self.scribble_color)
-                    scribble[7] = scribble[5]
-                    pixbuf = scribble[6]
-                if pixbuf:
+                if not pixbuf and stype == "latex" and widget is None:
+                    pixbuf = self.latex_to_pixbuf(extra[0], self.latex_resolution(), color)
+                elif not pixbuf and stype == "latex" and extra[0] != extra[2]:
+                    self.request_latex(scribble)
+                if pixbuf and widget is None:
+                    # Exporting: keep the full resolution of the image, scaled to its frame
+                    x, y = points[0][0] * ww, points[0][1] * wh
+                    w, h = pixbuf.get_width(), pixbuf.get_height()
+                    cairo_context.save()
+                    cairo_context.translate(x, y)
+                    if rect != [[0, 0], [0, 0]]:
+                        cairo_context.scale((rect[1][0] - rect[0][0]) * ww / w, (rect[1][1] - rect[0][1]) * wh / h)
+                    cairo_context.rectangle(0, 0, w, h)
+                    Gdk.cairo_set_source_pixbuf(cairo_context, pixbuf, 0, 0)
+                    cairo_context.fill()
+                    cairo_context.restore()
+                elif pixbuf:
                     if rect != [[0, 0], [0, 0]] and widget is self.p_da_cur:
                         w = int((rect[1][0] - rect[0][0]) * ww)
                         h = int((rect[1][1] - rect[0][1]) * wh)
-                        pixbuf = pixbuf.scale_simple(w, h, GdkPixbuf.InterpType.BILINEAR)
-                        if self.text_entry is scribble:
-                            pixbuf = pixbuf.add_alpha(True, 255, 255, 255)
-                    w, h = pixbuf.get_width(), pixbuf.get_height()
+                        surface = self.get_image_surface(scribble, pixbuf, w, h, self.text_entry is scribble)
+                    else:
+                        surface = self.get_image_surface(scribble, pixbuf, pixbuf.get_width(), pixbuf.get_height())
+                    w, h = surface.get_width(), surface.get_height()
                     x, y = int(points[0][0]*ww), int(points[0][1]*wh)
                     cairo_context.rectangle(x, y, w, h)
-                    Gdk.cairo_set_source_pixbuf(cairo_context, pixbuf, x, y)
+                    cairo_context.set_source_surface(surface, x, y)
                     cairo_context.paint()
                     cairo_context.reset_clip()
                     cairo_context.new_path()
@@ -1006,19 +1465,112 @@ class Scribbler(builder.Builder):
                         rect[0] = [points[0][0], points[0][1]]
                         rect[1] = [rect[0][0] + w/ww, rect[0][1] + h/wh]
 
-        if widget is self.p_da_cur and self.select_rect[1]:
-                points = [(p[0] * ww, p[1] * wh) for p in self.select_rect]
-                x0, y0 = points[0]
-                x1, y1 = points[1]
-                cairo_context.move_to(x0, y0)
-                cairo_context.line_to(x0, y1)
-                cairo_context.line_to(x1, y1)
-                cairo_context.line_to(x1, y0)
-                cairo_context.close_path()
-                cairo_context.set_source_rgba(0.3,0.3,0.3,0.8)
-                cairo_context.set_line_width(2)
-                cairo_context.set_dash([5,5,5])
-                cairo_context.stroke()
+    def get_layout(self, cairo_context, text, font, markup, pixels_per_point):
+        """ Get a Pango layout of a text, laid out once and reused across redraws.
+
+        Args:
+            cairo_context (:class:`~cairo.Context`): The canvas on which the text will be rendered
+            text (`str`): The text to lay out
+            font (`str`): The description of the font
+            markup (`bool`): Whether the text is Pango markup
+            pixels_per_point (`float`): The resolution of the canvas
+
+        Returns:
+            :class:`~Pango.Layout`: the layout, whose extents are computed once as well
+        """
+        key = (text, font, markup, pixels_per_point)
+        layout = self.layout_cache.get(key)
+        if layout is not None:
+            self.layout_cache.move_to_end(key)
+            return layout
+
+        layout = PangoCairo.create_layout(cairo_context)
+        PangoCairo.context_set_resolution(layout.get_context(), 72 * pixels_per_point)
+        layout.set_font_description(Pango.FontDescription(font))
+        if markup:
+            layout.set_markup(text)
+        else:
+            layout.set_text(text)
+
+        self.layout_cache[key] = layout
+        while len(self.layout_cache) > self.max_layouts:
+            self.layout_cache.popitem(last=False)
+        return layout
+
+    def get_image_surface(self, scribble, pixbuf, w, h, editing=False):
+        """ Get the image of an image or latex scribble as a surface of the given size, scaled and converted once.
+
+        Args:
+            scribble (`list`): The image or latex scribble
+            pixbuf (:class:`~GdkPixbuf.Pixbuf`): The image of the scribble
+            w (`int`): The width at which to draw the image
+            h (`int`): The height at which to draw the image
+            editing (`bool`): Whether the latex is being edited, and drawn with white made transparent
+
+        Returns:
+            :class:`~cairo.ImageSurface`: the image ready to be painted
+        """
+        w, h = max(1, w), max(1, h)
+        native = (w, h) == (pixbuf.get_width(), pixbuf.get_height())
+        # One scaled and one native surface per scribble: resizing replaces the scaled one
+        key = (id(scribble), native)
+        check = (pixbuf, w, h, editing)
+        cached = self.image_cache.get(key)
+        if cached is not None and cached[0] is scribble and cached[1] == check:
+            self.image_cache.move_to_end(key)
+            return cached[2]
+
+        scaled = pixbuf
+        if not native:
+            scaled = pixbuf.scale_simple(w, h, GdkPixbuf.InterpType.BILINEAR)
+        if editing:
+            scaled = scaled.add_alpha(True, 255, 255, 255)
+
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, w, h)
+        context = cairo.Context(surface)
+        Gdk.cairo_set_source_pixbuf(context, scaled, 0, 0)
+        context.paint()
+        del context
+
+        self.image_cache[key] = (scribble, check, surface)
+        while len(self.image_cache) > self.max_images:
+            self.image_cache.popitem(last=False)
+        return surface
+
+    def get_outline(self, scribble, ww, wh, width):
+        """ Get the outline of a pressure-sensitive stroke for a widget size, computing it only if needed.
+
+        Args:
+            scribble (`list`): the segment scribble
+            ww (`int`): the widget width
+            wh (`int`): the widget height
+            width (`float`): the width of the stroke at full pressure, in pixels
+
+        Returns:
+            :class:`~cairo.Path`: the outline of the stroke, in widget pixels
+        """
+        points = scribble[3]
+        key = (id(scribble), ww, wh)
+        # Detect modifications: points added or moved, width changed
+        check = (width, len(points), tuple(points[0]), tuple(points[-1]))
+        try:
+            stroke, cached_check, path = self.outline_cache[key]
+            if stroke is scribble and cached_check == check:
+                self.outline_cache.move_to_end(key)
+                return path
+        except KeyError:
+            pass
+
+        ctx = cairo.Context(cairo.ImageSurface(cairo.FORMAT_A1, 1, 1))
+        pressure_outline(ctx, [(p[0] * ww, p[1] * wh, p[2]) for p in points], width)
+        path = ctx.copy_path()
+
+        self.outline_cache[key] = (scribble, check, path)
+        self.outline_cache.move_to_end(key)
+        while len(self.outline_cache) > self.max_outlines:
+            self.outline_cache.popitem(False)
+        return path
+
 
     def update_font(self, widget):
         if widget.get_font():
@@ -1163,8 +1715,10 @@ class Scribbler(builder.Builder):
         """
         if 'page' in kwargs:
             # Clearing due to moving to a new page
+            self.store_undo_history()
             self.undo_stack = []
             self.undo_stack_pos = 0
+            self.undo_size = 0
             self.buttons["undo"].set_sensitive(False)
             self.buttons["redo"].set_sensitive(False)
             self.text_entry = False
@@ -1174,7 +1728,7 @@ class Scribbler(builder.Builder):
         del self.scribble_list[:]
         self.selected = []
 
-        self.redraw_current_slide()
+        self.redraw_current_slide('scribble')
 
 
     def on_configure_da(self, widget, event):
@@ -1218,7 +1772,7 @@ class Scribbler(builder.Builder):
         self.show_button("")
         self.pen_pointer_p = Gdk.Cursor.new_for_display(Gdk.Display.get_default(), Gdk.CursorType.X_CURSOR).get_image()
 
-        self.redraw_current_slide()
+        self.redraw_current_slide('scribble')
         extras.Cursor.set_cursor(self.p_central)
 
         return True
@@ -1308,26 +1862,106 @@ class Scribbler(builder.Builder):
             self.pen_pointer_p = Gdk.Cursor.new_for_display(Gdk.Display.get_default(), Gdk.CursorType.FLEUR).get_image()
         return True
 
+    def store_undo_history(self):
+        """ Keep the undo stack of the page being left, so that undo works when coming back to it.
+        """
+        if self.undo_page is None:
+            return
+        if self.undo_stack:
+            # Strokes were still empty when their operation was added, estimate again now that they are finished
+            self.undo_size = sum(undo_op_size(op) for op in self.undo_stack)
+            self.undo_histories[self.undo_page] = [self.undo_stack, self.undo_stack_pos, self.undo_size]
+            self.undo_histories.move_to_end(self.undo_page)
+        else:
+            self.undo_histories.pop(self.undo_page, None)
+        self.undo_page = None
+        self.undo_size = 0
+        self.trim_undo_histories()
+
+    def load_undo_history(self, page):
+        """ Restore the undo stack of the page being displayed, and start keeping undo stacks per page.
+
+        Args:
+            page (`int`): the number of the page being displayed
+        """
+        self.undo_page = page
+        self.undo_stack, self.undo_stack_pos, self.undo_size = self.undo_histories.pop(page, ([], 0, 0))
+        self.buttons["undo"].set_sensitive(self.undo_stack_pos > 0)
+        self.buttons["redo"].set_sensitive(self.undo_stack_pos < len(self.undo_stack))
+
+    def reset_undo_histories(self):
+        """ Forget the undo stacks of all pages, e.g. when opening a new document.
+        """
+        self.undo_histories.clear()
+        self.undo_page = None
+
+    def insert_undo_page(self, num):
+        """ Shift the undo stacks of the pages after an inserted page.
+
+        Args:
+            num (`int`): the number of the inserted page
+        """
+        self.undo_histories = collections.OrderedDict((p + 1 if p >= num else p, h)
+                                                      for p, h in self.undo_histories.items())
+        if self.undo_page is not None and self.undo_page >= num:
+            self.undo_page = self.undo_page + 1
+
+    def trim_undo_histories(self):
+        """ Drop the oldest undo operations, of the least recently displayed pages first, to fit the memory budget.
+        """
+        total = self.undo_size + sum(h[2] for h in self.undo_histories.values())
+        while total > self.max_undo_memory and self.undo_histories:
+            page, history = next(iter(self.undo_histories.items()))
+            # Operations to redo go first: an operation can only be dropped once all those before it are
+            if history[1] < len(history[0]):
+                size = sum(undo_op_size(op) for op in history[0][history[1]:])
+                del history[0][history[1]:]
+            else:
+                size = undo_op_size(history[0].pop(0))
+                history[1] -= 1
+            history[2] -= size
+            total -= size
+            if not history[0]:
+                del self.undo_histories[page]
+        # Only then the current page, always keeping its last operation
+        if total > self.max_undo_memory and self.undo_stack_pos < len(self.undo_stack):
+            size = sum(undo_op_size(op) for op in self.undo_stack[self.undo_stack_pos:])
+            del self.undo_stack[self.undo_stack_pos:]
+            self.undo_size -= size
+            total -= size
+            self.buttons["redo"].set_sensitive(False)
+        while total > self.max_undo_memory and len(self.undo_stack) > 1:
+            size = undo_op_size(self.undo_stack.pop(0))
+            self.undo_stack_pos -= 1
+            self.undo_size -= size
+            total -= size
+            if self.undo_stack_pos == 0:
+                self.buttons["undo"].set_sensitive(False)
+
     def add_undo(self, operation, update=False):
         if self.undo_stack_pos < len(self.undo_stack):
+            self.undo_size -= sum(undo_op_size(op) for op in self.undo_stack[self.undo_stack_pos:])
             del self.undo_stack[self.undo_stack_pos:]
         if update and self.undo_stack:
             if self.undo_stack[-1][0] == operation[0] == 'w':
                 if [x[0] for x in self.undo_stack[-1][1]] == [x[0] for x in operation[1]]:
                     for s in range(len(operation[1])):
                         operation[1][s][1] = self.undo_stack[-1][1][s][1]
-                self.undo_stack.pop()
+                self.undo_size -= undo_op_size(self.undo_stack.pop())
                 self.undo_stack_pos = self.undo_stack_pos - 1
             if self.undo_stack[-1][0] == operation[0] == 'p':
                 if [x[0] for x in self.undo_stack[-1][1]] == [x[0] for x in operation[1]]:
                     for s in range(len(operation[1])):
                         operation[1][s][1] = self.undo_stack[-1][1][s][1]
-                self.undo_stack.pop()
+                self.undo_size -= undo_op_size(self.undo_stack.pop())
                 self.undo_stack_pos = self.undo_stack_pos - 1
         self.undo_stack.append(operation)
         self.undo_stack_pos = self.undo_stack_pos + 1
+        self.undo_size += undo_op_size(operation)
         self.buttons["redo"].set_sensitive(False)
         self.buttons["undo"].set_sensitive(True)
+        if self.undo_size > self.max_undo_memory:
+            self.trim_undo_histories()
         return True
 
     def undo(self, *args):
@@ -1358,7 +1992,7 @@ class Scribbler(builder.Builder):
             elif op[0] == 'm':
                 adjust_scribbles(op[1], -op[2], -op[3])
 
-            self.redraw_current_slide()
+            self.redraw_current_slide('scribble')
         return True
 
     def redo(self, *args):
@@ -1391,7 +2025,7 @@ class Scribbler(builder.Builder):
                 self.buttons["redo"].set_sensitive(False)
             self.buttons["undo"].set_sensitive(True)
 
-            self.redraw_current_slide()
+            self.redraw_current_slide('scribble')
         return True
 
     def width_curve_r(self, value):
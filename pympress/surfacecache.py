@@ -30,19 +30,25 @@ is done by the :class:`~pympress.surfacecache.SurfaceCache` class, using several
 The problem is, neither Gtk+ nor Poppler are particularly threadsafe.
 Hence the prerendering isn't really done in parallel in another thread, but
 scheduled on the main thread at idle times using GLib.idle_add().
+Only the compression of renderings evicted from the cache, which does not
+involve Gtk+ nor Poppler, happens in another thread.
 """
 
 import logging
 logger = logging.getLogger(__name__)
 
+import zlib
 import threading
 import collections
+import concurrent.futures
 
 import gi
 import cairo
 gi.require_version('Gtk', '3.0')
 from gi.repository import GLib
 
+from pympress.document import PdfPage
+
 
 class OrderedDict(collections.OrderedDict):
     """ OrderedDict for python2 compatibility, adding move_to_end().
@@ -66,6 +72,8 @@ class SurfaceCache(object):
     Args:
         doc (:class:`~pympress.document.Document`):  the current document
         max_pages (`int`): The maximum page number.
+        downscale_threshold (`float`): see :attr:`downscale_threshold`
+        cold_budget (`int`): The maximum size of the compressed renderings, in MiB
     """
 
     #: The actual cache. It is a `dict` of :class:`~pympress.surfacecache.Cache`:
@@ -87,8 +95,13 @@ class SurfaceCache(object):
     #: widget names and its values are document types from ui.
     surface_type = {}
 
+    #: Surfaces cached for widgets before they were resized, displayed scaled until the pages are rendered at the
+    #: new size. It is a `dict` whose keys are widget names and values are tuples of the previous size of the widget
+    #: and of its previous :class:`~pympress.surfacecache.OrderedDict` of cached surfaces.
+    placeholders = {}
+
     #: Dictionary of :class:`~threading.Lock` used for managing conccurent
-    #: accesses to :attr:`surface_cache` and :attr:`surface_size`
+    #: accesses to :attr:`surface_cache`, :attr:`surface_size` and :attr:`placeholders`
     locks = {}
 
     #: The current :class:`~pympress.document.Document`.
@@ -103,10 +116,57 @@ class SurfaceCache(object):
     #: maximum number fo pages we keep in cache
     max_pages = 200
 
-    def __init__(self, doc, max_pages):
+    #: :class:`~pympress.surfacecache.OrderedDict` of renderings of pdf pages (:class:`~cairo.ImageSurface`),
+    #: from which the widgets' surfaces are cut out. Its keys are tuples of the pdf page number, the size of the
+    #: rendering and the part of the page rendered (:class:`~pympress.document.PdfPage`), ordered by Least Recently
+    #: Used. Only the halves of pages displayed in two widgets at the same scale are rendered as full pages.
+    page_rasters = None
+
+    #: :class:`~threading.Lock` used to manage conccurent accesses to :attr:`page_rasters`
+    raster_lock = None
+
+    #: Minimum ratio between the sizes of a cached rendering and of a smaller one of the same page, for the smaller
+    #: one to be obtained by downscaling rather than by rendering. Downscaling by less blurs the text. 0 disables.
+    downscale_threshold = 1.5
+
+    #: :class:`~pympress.surfacecache.OrderedDict` of the renderings evicted from :attr:`page_rasters`, with the same
+    #: keys, ordered by Least Recently Used. Its values are tuples of the stride, the zlib-compressed pixels, and
+    #: for overlays stored as differences, the key of the rendering they differ from, the checksum of its pixels and
+    #: the `tuple` of the x, y, width, height of the tiles whose pixels are stored (or `None` thrice otherwise).
+    #: Also protected by :attr:`raster_lock`.
+    cold_rasters = None
+
+    #: `dict` of the first pdf page with the same label as a pdf page, see
+    #: :meth:`~pympress.document.Document.overlay_base`. Also protected by :attr:`raster_lock`.
+    overlay_bases = None
+
+    #: Size in pixels of the square tiles compared to store overlays as differences
+    tile_size = 64
+
+    #: Total size in bytes of the compressed pixels in :attr:`cold_rasters`
+    cold_size = 0
+
+    #: Maximum total size in bytes of the compressed pixels in :attr:`cold_rasters`, 0 disables compression
+    cold_budget = 0
+
+    #: `dict` of the renderings (:class:`~cairo.ImageSurface`) being compressed after their eviction, by key
+    evicted_rasters = None
+
+    #: :class:`~concurrent.futures.ThreadPoolExecutor` compressing the evicted renderings
+    compressor = None
+
+    def __init__(self, doc, max_pages, downscale_threshold = 1.5, cold_budget = 256):
         self.max_pages = max_pages
+        self.downscale_threshold = downscale_threshold
+        self.cold_budget = cold_budget * 1024 * 1024
         self.doc = doc
         self.doc_lock = threading.Lock()
+        self.page_rasters = OrderedDict()
+        self.raster_lock = threading.Lock()
+        self.cold_rasters = OrderedDict()
+        self.overlay_bases = {}
+        self.evicted_rasters = {}
+        self.compressor = concurrent.futures.ThreadPoolExecutor(max_workers = 1)
 
 
     def add_widget(self, widget, wtype, prerender_enabled = True, zoomed = False):
@@ -142,6 +202,13 @@ class SurfaceCache(object):
         with self.doc_lock:
             self.doc = new_doc
 
+        with self.raster_lock:
+            self.page_rasters.clear()
+            self.cold_rasters.clear()
+            self.cold_size = 0
+            self.overlay_bases.clear()
+            self.evicted_rasters.clear()
+
         for widget_name in self.locks:
             with self.locks[widget_name]:
                 self.surface_cache[widget_name].clear()
@@ -203,15 +270,50 @@ class SurfaceCache(object):
     def resize_widget(self, widget_name, width, height):
         """ Change the size of a registered widget, thus invalidating all the cached pages.
 
+        The cached pages are kept as placeholders, see :meth:`get_placeholder`, until :meth:`drop_placeholders`.
+        While a widget is resized several times in a row, the placeholders are the last pages rendered.
+
         Args:
             widget_name (`str`):  name of the widget that is resized
             width (`int`):  new width of the widget
             height (`int`):  new height of the widget
+
+        Returns:
+            `bool`: `True` iff the size of the widget changed
         """
         with self.locks[widget_name]:
-            if (width, height) != self.surface_size[widget_name]:
-                self.surface_cache[widget_name].clear()
-                self.surface_size[widget_name] = (width, height)
+            if (width, height) == self.surface_size[widget_name]:
+                return False
+
+            if self.surface_cache[widget_name]:
+                self.placeholders[widget_name] = (self.surface_size[widget_name], self.surface_cache[widget_name])
+            self.surface_cache[widget_name] = OrderedDict()
+            self.surface_size[widget_name] = (width, height)
+            return True
+
+
+    def get_placeholder(self, widget_name, page_nb):
+        """ Fetch a page rendered for the specified widget before it was resized.
+
+        Args:
+            widget_name (`str`):  name of the concerned widget
+            page_nb (`int`):  number of the page to fetch
+
+        Returns:
+            `tuple`: the :class:`~cairo.Surface` of the page and the `tuple` of the size of the widget it was rendered
+            for, or `None` if there is no such page
+        """
+        with self.locks[widget_name]:
+            size, pc = self.placeholders.get(widget_name, (None, {}))
+            return (pc[page_nb], size) if page_nb in pc else None
+
+
+    def drop_placeholders(self):
+        """ Forget the pages rendered for all widgets before they were resized.
+        """
+        for widget_name in list(self.placeholders):
+            with self.locks[widget_name]:
+                self.placeholders.pop(widget_name, None)
 
 
     def get(self, widget_name, page_nb):
@@ -250,6 +352,320 @@ class SurfaceCache(object):
                 pc.popitem(False)
 
 
+    def shares_raster(self, widget_name, ww, wh):
+        """ Check whether a widget displays half of a page at the same scale as a widget displaying the other half.
+
+        Args:
+            widget_name (`str`):  name of the concerned widget
+            ww (`int`):  width of the widget
+            wh (`int`):  height of the widget
+
+        Returns:
+            `bool`: `True` iff both halves of the page can be cut out of a single full page rendering
+        """
+        wtype = self.surface_type[widget_name]
+        if wtype not in (PdfPage.LEFT, PdfPage.RIGHT, PdfPage.TOP, PdfPage.BOTTOM):
+            return False
+
+        return any(self.surface_type[name] == wtype.complement() and self.surface_size[name] == (ww, wh)
+                   for name in self.surface_type if not name.endswith('_zoomed'))
+
+
+    @staticmethod
+    def raster_geometry(page, ww, wh, wtype, shared):
+        """ Compute the size of the rendering needed to display part of a page in a widget.
+
+        Args:
+            page (:class:`~pympress.document.Page`):  the page to display
+            ww (`int`):  width of the widget
+            wh (`int`):  height of the widget
+            wtype (:class:`~pympress.document.PdfPage`):  the part of the page displayed by the widget
+            shared (`bool`):  whether to render the full page, to share it with the widget displaying the other half
+
+        Returns:
+            `tuple`: the size of the rendering, the part of the page rendered, and the rectangle of the displayed part
+            in the rendering, or `None` if the whole rendering is displayed
+        """
+        pw, ph = page.get_size(wtype)
+        scale = min(ww / pw, wh / ph)
+        # round the size of the displayed part, so that both halves start on a pixel boundary
+        hw, hh = max(1, round(pw * scale)), max(1, round(ph * scale))
+
+        if not shared:
+            return (hw, hh), wtype, None
+        elif wtype in (PdfPage.LEFT, PdfPage.RIGHT):
+            return (2 * hw, hh), PdfPage.FULL, (hw if wtype == PdfPage.RIGHT else 0, 0, hw, hh)
+        else:
+            return (hw, 2 * hh), PdfPage.FULL, (0, hh if wtype == PdfPage.BOTTOM else 0, hw, hh)
+
+
+    def get_raster(self, page, size, part, factory):
+        """ Get a rendering of a pdf page, from the cache or by rendering it.
+
+        Args:
+            page (:class:`~pympress.document.Page`):  the page to render
+            size (`tuple`):  the width and height of the rendering
+            part (:class:`~pympress.document.PdfPage`):  the part of the page to render
+            factory (`function`):  creates a surface given a :class:`~cairo.Format`, width and height
+
+        Returns:
+            :class:`~cairo.ImageSurface`: the rendered page
+        """
+        key = (page.page_nb, size, part)
+        with self.raster_lock:
+            if key in self.page_rasters:
+                self.page_rasters.move_to_end(key)
+                return self.page_rasters[key]
+
+            source = None
+            surface = self.evicted_rasters.pop(key, None)
+            compressed = self.cold_rasters.get(key) if surface is None else None
+            if compressed is not None:
+                self.cold_rasters.move_to_end(key)
+            elif surface is None:
+                source = self.find_larger_raster(page.page_nb, size, part)
+
+        if compressed is not None:
+            surface = self.decompress_raster(compressed, size, factory)
+            if surface is None:
+                # Render it again below, and compress it anew once evicted
+                with self.raster_lock:
+                    if self.cold_rasters.get(key) is compressed:
+                        del self.cold_rasters[key]
+                        self.cold_size -= len(compressed[1])
+
+        if surface is not None:
+            self.store_raster(key, surface)
+            return surface
+
+        surface = factory(cairo.Format.RGB24, *size)
+        context = cairo.Context(surface)
+        if source is None:
+            page.render_cairo(context, size[0], size[1], part)
+        else:
+            context.scale(size[0] / source.get_width(), size[1] / source.get_height())
+            context.set_source_surface(source, 0, 0)
+            context.get_source().set_filter(cairo.FILTER_GOOD)
+            context.paint()
+        del context
+
+        self.store_raster(key, surface)
+        return surface
+
+
+    def find_larger_raster(self, pdf_page, size, part):
+        """ Find the smallest cached rendering of a page that is large enough to be downscaled to the given size.
+
+        Must be called with :attr:`raster_lock` held.
+
+        Args:
+            pdf_page (`int`):  the pdf page number
+            size (`tuple`):  the width and height of the wanted rendering
+            part (:class:`~pympress.document.PdfPage`):  the part of the page rendered
+
+        Returns:
+            :class:`~cairo.ImageSurface`: the rendering to downscale, or `None` if there is none
+        """
+        if not self.downscale_threshold:
+            return None
+
+        candidates = [(cached_size, surface) for (nb, cached_size, cached_part), surface in self.page_rasters.items()
+                      if nb == pdf_page and cached_part == part and cached_size[0] >= self.downscale_threshold * size[0]
+                      and cached_size[1] >= self.downscale_threshold * size[1]]
+        if not candidates:
+            return None
+
+        return min(candidates, key = lambda candidate: candidate[0])[1]
+
+
+    def store_raster(self, key, surface):
+        """ Add a page rendering to :attr:`page_rasters`, evicting the least recently used ones.
+
+        Args:
+            key (`tuple`):  the pdf page number, the size of the rendering and the part of the page rendered
+            surface (:class:`~cairo.ImageSurface`):  the rendered page
+        """
+        # Each widget keeps up to max_pages surfaces cut out of renderings: keep as many renderings, so that those
+        # still displayed are not evicted and compressed. Zoomed widgets do not use the renderings.
+        max_rasters = self.max_pages * max(1, sum(not name.endswith('_zoomed') for name in self.surface_cache))
+
+        with self.raster_lock:
+            self.page_rasters[key] = surface
+            self.page_rasters.move_to_end(key)
+
+            while len(self.page_rasters) > max_rasters:
+                evicted_key, evicted = self.page_rasters.popitem(False)
+                # Renderings never change, so those already compressed need not be compressed again
+                if self.cold_budget and evicted_key not in self.cold_rasters:
+                    evicted.flush()
+                    self.evicted_rasters[evicted_key] = evicted
+                    self.compressor.submit(self.compress_raster, evicted_key, evicted)
+
+
+    def compress_raster(self, key, surface):
+        """ Compress the pixels of a rendering evicted from :attr:`page_rasters` into :attr:`cold_rasters`.
+
+        Runs in the :attr:`compressor` thread. Flat slides compress well even with the fastest zlib level.
+        Overlays are stored as the tiles that differ from the first page with the same label, when its rendering at
+        the same size is available and enough tiles are identical.
+
+        Args:
+            key (`tuple`):  the pdf page number, the size of the rendering and the part of the page rendered
+            surface (:class:`~cairo.ImageSurface`):  the evicted rendering
+        """
+        stride, pixels = surface.get_stride(), bytes(surface.get_data())
+        compressed = None
+
+        with self.raster_lock:
+            base_nb = self.overlay_bases.get(key[0], key[0])
+        if base_nb != key[0]:
+            base_key = (base_nb,) + key[1:]
+            base = self.raster_pixels(base_key)
+            tiles = self.diff_tiles(pixels, base, stride, key[1]) if base is not None else None
+            if tiles is not None:
+                data = b''.join(pixels[y * stride + 4 * x:y * stride + 4 * (x + w)]
+                                for x, ty, w, h in tiles for y in range(ty, ty + h))
+                compressed = (stride, zlib.compress(data, 1), base_key, zlib.adler32(base), tiles)
+
+        if compressed is None:
+            compressed = (stride, zlib.compress(pixels, 1), None, None, None)
+
+        with self.raster_lock:
+            if self.evicted_rasters.get(key) is not surface:
+                # The rendering was used again, or the document changed, while compressing
+                return
+            del self.evicted_rasters[key]
+
+            self.cold_rasters[key] = compressed
+            self.cold_rasters.move_to_end(key)
+            self.cold_size += len(compressed[1])
+
+            while self.cold_size > self.cold_budget:
+                dropped = self.cold_rasters.popitem(False)[1]
+                self.cold_size -= len(dropped[1])
+
+
+    def diff_tiles(self, pixels, base, stride, size):
+        """ List the tiles of a rendering that differ from another rendering of the same size.
+
+        Args:
+            pixels (`bytes`):  the pixels of the rendering
+            base (`bytes`):  the pixels of the rendering to compare to
+            stride (`int`):  the number of bytes per row of pixels
+            size (`tuple`):  the width and height of the renderings
+
+        Returns:
+            `tuple`: the x, y, width, height of the tiles that differ, or `None` if most of them do
+        """
+        width, height = size
+        tiles, total = [], 0
+        for ty in range(0, height, self.tile_size):
+            h = min(self.tile_size, height - ty)
+            for x in range(0, width, self.tile_size):
+                w = min(self.tile_size, width - x)
+                total += 1
+                rows = (slice(y * stride + 4 * x, y * stride + 4 * (x + w)) for y in range(ty, ty + h))
+                if any(pixels[row] != base[row] for row in rows):
+                    tiles.append((x, ty, w, h))
+
+        return tuple(tiles) if 2 * len(tiles) <= total else None
+
+
+    def raster_pixels(self, key):
+        """ Get the pixels of a rendering from the cache, if it is not stored as differences to another rendering.
+
+        Args:
+            key (`tuple`):  the pdf page number, the size of the rendering and the part of the page rendered
+
+        Returns:
+            `bytes`: the pixels, or `None` if the rendering is not available
+        """
+        with self.raster_lock:
+            surface = self.page_rasters.get(key, self.evicted_rasters.get(key))
+            compressed = self.cold_rasters.get(key) if surface is None else None
+            if compressed is not None:
+                self.cold_rasters.move_to_end(key)
+
+        if surface is not None:
+            return bytes(surface.get_data())
+        elif compressed is not None and compressed[2] is None:
+            return zlib.decompress(compressed[1])
+        else:
+            return None
+
+
+    def decompress_raster(self, compressed, size, factory):
+        """ Restore a rendering from its compressed pixels.
+
+        Args:
+            compressed (`tuple`):  the stride and the compressed pixels, and the differences information, see
+                                   :attr:`cold_rasters`
+            size (`tuple`):  the width and height of the rendering
+            factory (`function`):  creates a surface given a :class:`~cairo.Format`, width and height
+
+        Returns:
+            :class:`~cairo.ImageSurface`: the rendering, or `None` if it can not be restored in a surface from factory,
+            or if the rendering it differs from is missing or is not the one it was compared to
+        """
+        stride, data, base_key, checksum, tiles = compressed
+        surface = factory(cairo.Format.RGB24, *size)
+        if surface.get_stride() != stride:
+            return None
+
+        if base_key is None:
+            pixels = zlib.decompress(data)
+        else:
+            # The base may have been evicted and obtained again differently since, e.g. by downscaling
+            pixels = self.raster_pixels(base_key)
+            if pixels is None or zlib.adler32(pixels) != checksum:
+                return None
+
+            pixels, data, pos = bytearray(pixels), zlib.decompress(data), 0
+            for x, ty, w, h in tiles:
+                for y in range(ty, ty + h):
+                    pixels[y * stride + 4 * x:y * stride + 4 * (x + w)] = data[pos:pos + 4 * w]
+                    pos += 4 * w
+
+        surface.flush()
+        surface.get_data()[:] = pixels
+        surface.mark_dirty()
+        return surface
+
+
+    def render(self, widget_name, page_nb, ww, wh):
+        """ Get the surface showing a page in a widget, possibly cut out from a rendering of the full page.
+
+        Both halves of a page with notes share the same rendering when they are displayed at the same scale, since
+        cairo sub-surfaces share the pixels of their target. Otherwise only the displayed half is rendered.
+
+        Args:
+            widget_name (`str`):  name of the concerned widget
+            page_nb (`int`):  number of the page to render
+            ww (`int`):  width of the widget
+            wh (`int`):  height of the widget
+
+        Returns:
+            :class:`~cairo.Surface`: the surface to paint in the widget, or `None` if there is no such page
+        """
+        with self.locks[widget_name]:
+            wtype = self.surface_type[widget_name]
+            factory = self.surface_factory[widget_name]
+            shared = self.shares_raster(widget_name, ww, wh)
+
+        with self.doc_lock:
+            page = self.doc.page(page_nb)
+            base_nb = self.doc.overlay_base(page.page_nb) if page is not None else None
+        if page is None:
+            return None
+
+        with self.raster_lock:
+            self.overlay_bases[page.page_nb] = base_nb
+
+        size, part, rect = self.raster_geometry(page, ww, wh, wtype, shared)
+        raster = self.get_raster(page, size, part, factory)
+        return raster if rect is None else raster.create_for_rectangle(*rect)
+
+
     def prerender(self, page_nb):
         """ Queue a page for prerendering.
 
@@ -258,7 +674,11 @@ class SurfaceCache(object):
         Args:
             page_nb (`int`):  number of the page to be prerendered
         """
-        for name in self.active_widgets:
+        # Largest widgets first, so that the smaller ones can downscale their renderings
+        def area(name):
+            return self.surface_size[name][0] * self.surface_size[name][1]
+
+        for name in sorted(self.active_widgets, key = area, reverse = True):
             GLib.idle_add(self.renderer, name, page_nb)
 
 
@@ -282,26 +702,20 @@ class SurfaceCache(object):
                 # Already in cache
                 return False
             ww, wh = self.surface_size[widget_name]
-            wtype = self.surface_type[widget_name]
 
         if ww < 0 or wh < 0:
             logger.warning('Widget {} with invalid size {}x{} when rendering'.format(widget_name, ww, wh))
             return
 
-        with self.doc_lock:
-            page = self.doc.page(page_nb)
-            pw, ph = page.get_size(wtype)
-
         # Render to a ImageSurface
         try:
-            surface = self.surface_factory[widget_name](cairo.Format.RGB24, ww, wh)
+            surface = self.render(widget_name, page_nb, ww, wh)
         except AttributeError:
             logger.warning('Widget {} was not mapped when rendering'.format(widget_name), exc_info = True)
             return False
 
-        context = cairo.Context(surface)
-        page.render_cairo(context, ww, wh, wtype)
-        del context
+        if surface is None:
+            return False
 
         # Save if possible and necessary
         with self.locks[widget_name]:
@@ -38,7 +38,6 @@ logger = logging.getLogger(__name__)
 
 import os.path
 import sys
-import json
 
 import gi
 import cairo
@@ -85,9 +84,9 @@ class UI(builder.Builder):
     #: :class:`~Gtk.CheckMenuItem` that shows whether the annotations are toggled
     pres_annot = None
 
-    #: Indicates whether we should delay redraws on some drawing areas to fluidify resizing gtk.paned
+    #: Indicates whether we should delay rendering on drawing areas to fluidify resizing windows or gtk.paned
     resize_panes = False
-    #: Tracks return values of GLib.timeout_add to cancel gtk.paned's redraw callbacks
+    #: Tracks return values of GLib.timeout_add to cancel the redraw callbacks after resizing
     redraw_timeout = 0
 
     #: Whether to use notes mode or not
@@ -128,6 +127,8 @@ class UI(builder.Builder):
 
     #: :class:`~pympress.surfacecache.SurfaceCache` instance.
     cache = None
+    #: :class:`~pympress.util.RedrawScheduler` coalescing redraws of the current slide
+    redraw = None
 
     #: Current :class:`~pympress.document.Document` instance.
     doc = document.EmptyDocument()
@@ -167,6 +168,15 @@ class UI(builder.Builder):
     highlight_mode = "clear"
 
     pen_pointer = [()]
+    #: :class:`~GdkPixbuf.Pixbuf` of the pen pointer in the Content window
+    pen_pointer_c = None
+
+    #: :class:`~Gtk.DrawingArea` layer on top of the Content window's slide, where the pointers are drawn
+    c_pointer_layer = None
+    #: :class:`~Gtk.DrawingArea` layer on top of the Presenter window's current slide, where the pointers are drawn
+    p_pointer_layer = None
+    #: `dict` of the `list` of rectangles where pointers were last drawn, indexed by pointer layer
+    pointer_rects = {}
 
     hlines = 0
     vlines = 0
@@ -204,12 +214,20 @@ class UI(builder.Builder):
         self.min_distance = self.config.getfloat('presenter', 'min_distance')
 
         # Surface cache
-        self.cache = surfacecache.SurfaceCache(self.doc, self.config.getint('cache', 'maxpages'))
+        self.cache = surfacecache.SurfaceCache(self.doc, self.config.getint('cache', 'maxpages'),
+                                               self.config.getfloat('cache', 'downscale_threshold', fallback=1.5),
+                                               self.config.getint('cache', 'cold_budget', fallback=256))
+        self.redraw = util.RedrawScheduler()
 
         # Make and populate windows
         self.load_ui('presenter')
         self.load_ui('content')
 
+        # Pointers are drawn on their own layer, so that moving them only redraws around them
+        self.pointer_rects = {}
+        self.c_pointer_layer = self.add_pointer_layer(self.get_object('c_overlay'))
+        self.p_pointer_layer = self.add_pointer_layer(self.get_object('p_overlay'))
+
         self.zoom = extras.Zoom(self)
         self.scribbler = scribble.Scribbler(self.config, self, self.notes_mode)
         self.annotations = extras.Annotations(self)
@@ -219,6 +237,7 @@ class UI(builder.Builder):
         self.page_number = editable_label.PageNumber(self, self.config.getboolean('presenter', 'scroll_number'))
         self.talk_time = talk_time.TimeCounter(self, self.est_time)
         self.timing = extras.TimingReport(self)
+        util.StartupProfiler.mark('widgets created')
 
         # Get placeable widgets. NB, get the highlight one manually from the scribbler class
         self.placeable_widgets = {
@@ -265,29 +284,6 @@ class UI(builder.Builder):
         self.hlines = self.config.getfloat('presenter', 'horizontal_lines')
         self.vlines = self.config.getfloat('presenter', 'vertical_lines')
 
-        self.scribbler.latex_dict = json.load(open(util.get_latex_dict()))
-        self.scribbler.latex_macros = {
-            "latex": { "ctrl": {}, "alt": {}, "altctrl": {}, },
-            "markup": { "ctrl": {}, "alt": {}, "altctrl": {}, },
-            "text": { "ctrl": {}, "alt": {}, "altctrl": {}, },
-        }
-        try:
-            personal_dict = json.load(open(util.get_personal_dict()))
-            self.scribbler.latex_dict.update(personal_dict['shortcuts'])
-            for dicts in self.scribbler.latex_macros.keys():
-                for m in personal_dict[dicts].keys():
-                    for k, v in personal_dict[dicts][m].items():
-                        p = v.find("\f")
-                        if p == -1:
-                            p = len(v)
-                        self.scribbler.latex_macros[dicts][m][k] = (v.replace("\f", ""), p)
-        except FileNotFoundError:
-            pass
-        except KeyError:
-            pass
-        keys = sorted(self.scribbler.latex_dict.keys())
-        self.scribbler.latex_prefixes = {keys[x] for x in range(len(keys)-1) if keys[x+1].startswith(keys[x])}
-
         self.scribbler.laser = self.laser
 
 
@@ -630,7 +626,8 @@ class UI(builder.Builder):
         if not event.send_event:
             return
 
-        self.cache.resize_widget(widget.get_name(), event.width, event.height)
+        if self.cache.resize_widget(widget.get_name(), event.width, event.height):
+            self.delay_redraw()
 
         if widget is self.c_da:
             self.medias.resize('content')
@@ -655,7 +652,7 @@ class UI(builder.Builder):
 
     def redraw_selected(self):
         self.scribbler.draw_blink = not self.scribbler.draw_blink
-        self.p_da_cur.queue_draw()
+        self.redraw.request((self.p_da_cur,), 'blink')
         return True
 
     def redraw_panes(self):
@@ -664,14 +661,28 @@ class UI(builder.Builder):
         Used for delayed drawing events of drawing areas inside the panes.
 
         This is very useful on windows where resizing gets sluggish if we try to redraw while resizing.
+        The visible pages are rendered at their new size first, as redraws have priority over the
+        prerendering of the next and previous pages.
         """
         self.resize_panes = False
+        self.cache.drop_placeholders()
+        self.c_da.queue_draw()
         self.p_da_cur.queue_draw()
         self.p_da_next.queue_draw()
         if self.notes_mode:
             self.p_da_notes.queue_draw()
         if self.redraw_timeout:
             self.redraw_timeout = 0
+        self.prerender_pages()
+
+
+    def delay_redraw(self):
+        """ Display the pages scaled from their previous size until no resize happened for 200ms.
+        """
+        self.resize_panes = True
+        if self.redraw_timeout:
+            GLib.Source.remove(self.redraw_timeout)
+        self.redraw_timeout = GLib.timeout_add(200, self.redraw_panes)
 
 
     def on_pane_event(self, widget, evt):
@@ -687,10 +698,7 @@ class UI(builder.Builder):
         if type(evt) == Gdk.EventButton and evt.type == Gdk.EventType.BUTTON_RELEASE:
             self.redraw_panes()
         elif type(evt) == GObject.GParamSpec and evt.name == "position":
-            self.resize_panes = True
-            if self.redraw_timeout:
-                GLib.Source.remove(self.redraw_timeout)
-            self.redraw_timeout = GLib.timeout_add(200, self.redraw_panes)
+            self.delay_redraw()
 
 
     ############################################################################
@@ -725,6 +733,7 @@ class UI(builder.Builder):
             self.doc.scribbles[self.doc.cur_page] = self.scribbler.scribble_list[:]
         self.doc.save_scribbles()
         self.config.save_config()
+        self.redraw.log_stats()
         self.p_win.destroy()
         self.c_win.destroy()
 
@@ -819,6 +828,9 @@ class UI(builder.Builder):
             self.timing.reset(int(self.talk_time.delta))
             self.talk_time.reset_timer()
 
+        if not reloading:
+            self.scribbler.reset_undo_histories()
+
         self.on_page_change(False, reloading=reloading)
         page_type = self.notes_mode.complement()
         self.c_frame.set_property("ratio", self.doc.current_page().get_aspect_ratio(page_type))
@@ -863,13 +875,48 @@ class UI(builder.Builder):
     def export_xopp(self, *args):
         if self.highlight_mode in ('autopage') and self.doc.cur_page >= 0:
             self.doc.scribbles[self.doc.cur_page] = self.scribbler.scribble_list[:]
-        self.doc.export_xopp()
+        self.start_export('export_xopp', self.doc.export_xopp)
 
     def export_pdf(self, *args):
         # Make sure the current scribbles are also exported
         if self.highlight_mode in ('autopage') and self.doc.cur_page >= 0:
             self.doc.scribbles[self.doc.cur_page] = self.scribbler.scribble_list[:]
-        self.doc.export_pdf()
+        self.start_export('export_pdf', self.doc.export_pdf)
+
+    def start_export(self, name, export):
+        """ Run an export in the background, showing its progress on the toolbar button that started it.
+
+        Args:
+            name (`str`): the name of the export button
+            export (`function`): the export method of the document
+        """
+        button = self.scribbler.buttons.get(name)
+        if button is None:
+            export()
+            return
+        if not button.get_sensitive():
+            # Already running
+            return
+
+        tooltip = button.get_tooltip_text()
+        button.set_sensitive(False)
+
+        def progress(fraction):
+            button.set_tooltip_text('{} ({:.0%})'.format(tooltip, fraction))
+
+        def done(error):
+            button.set_sensitive(True)
+            button.set_tooltip_text(tooltip)
+            if error is not None:
+                dialog = Gtk.MessageDialog(transient_for = self.p_win, flags = Gtk.DialogFlags.MODAL,
+                                           message_type = Gtk.MessageType.ERROR,
+                                           message_format = _('Export failed: {}').format(error))
+                dialog.add_buttons(Gtk.STOCK_CLOSE, Gtk.ResponseType.CLOSE)
+                dialog.set_position(Gtk.WindowPosition.CENTER)
+                dialog.run()
+                dialog.destroy()
+
+        export(progress=progress, done=done)
 
     def pick_file(self, *args):
         """ Ask the user which file he means to open.
@@ -937,12 +984,14 @@ class UI(builder.Builder):
             if p - 1 in self.doc.scribbles:
                 self.doc.scribbles[p] = self.doc.scribbles[p - 1]
                 del self.doc.scribbles[p - 1]
-        self.redraw_current_slide()
+        self.scribbler.insert_undo_page(num)
+        self.redraw_current_slide('page')
 
     def insert_page(self, num):
         """ Insert an empty page before page num in document
         """
         self.doc.insert_page(num)
+        self.scribbler.insert_undo_page(num)
         self.page_number.set_last(self.doc.pages_number())
 
         # Clear all widget caches
@@ -1063,6 +1112,11 @@ class UI(builder.Builder):
                         self.scribbler.scribble_list += self.doc.scribbles[self.page_preview_nb][:]
                 except AttributeError:
                     pass
+                # Undo history follows the scribbles: restored per page, or carried over with them
+                if keep_scribbles:
+                    self.scribbler.undo_page = self.page_preview_nb
+                else:
+                    self.scribbler.load_undo_history(self.page_preview_nb)
 
         # Start counter if needed
         if unpause:
@@ -1072,13 +1126,24 @@ class UI(builder.Builder):
         # Update display
         self.page_number.update_page_numbers(self.page_preview_nb, page_cur.label())
 
-        # Prerender the 4 next pages and the 2 previous ones
+        page_max = self.prerender_pages()
+
+        self.medias.replace_media_overlays(self.doc.current_page(), page_type)
+        self.medias.preload_media_overlays([self.doc.page(p) for p in range(self.page_preview_nb + 1, page_max)],
+                                           page_type)
+
+
+    def prerender_pages(self):
+        """ Prerender the 4 next pages and the 2 previous ones.
+
+        Returns:
+            `int`: the number of the page after the last page prerendered
+        """
         page_max = min(self.doc.pages_number(), self.page_preview_nb + 5)
         page_min = max(0, self.page_preview_nb - 2)
         for p in list(range(self.page_preview_nb + 1, page_max)) + list(range(self.page_preview_nb, page_min, -1)):
             self.cache.prerender(p)
-
-        self.medias.replace_media_overlays(self.doc.current_page(), page_type)
+        return page_max
 
 
     def on_draw(self, widget, cairo_context):
@@ -1124,21 +1189,30 @@ class UI(builder.Builder):
             zoom_matrix = cairo.Matrix()
 
         pb = self.cache.get(name, nb)
-        if pb is None:
-            if self.resize_panes and widget in (self.p_da_next, self.p_da_cur, self.p_da_notes):
-                # too slow to render here when resize_panes things
-                return
-
+        placeholder = self.cache.get_placeholder(name, nb) if pb is None and self.resize_panes else None
+        if placeholder is not None:
+            # Too slow to render while resizing: stretch the page rendered at the previous size
+            pb, (pw, ph) = placeholder
+            cairo_context.save()
+            cairo_context.scale(ww / pw, wh / ph)
+            cairo_context.set_source_surface(pb, 0, 0)
+            cairo_context.paint()
+            cairo_context.restore()
+        elif pb is None:
             # Cache miss: render the page, and save it to the cache
-            try:
-                # In some pygtk versions this call always fails the first time
-                pb = widget.get_window().create_similar_image_surface(cairo.Format.RGB24, ww, wh, 0)
-            except:
-                pb = widget.get_window().create_similar_image_surface(cairo.Format.RGB24, ww, wh, 0)
-
-            cairo_prerender = cairo.Context(pb)
-            cairo_prerender.transform(zoom_matrix)
-            page.render_cairo(cairo_prerender, ww, wh, wtype)
+            if name.endswith('_zoomed'):
+                try:
+                    # In some pygtk versions this call always fails the first time
+                    pb = widget.get_window().create_similar_image_surface(cairo.Format.RGB24, ww, wh, 0)
+                except:
+                    pb = widget.get_window().create_similar_image_surface(cairo.Format.RGB24, ww, wh, 0)
+
+                cairo_prerender = cairo.Context(pb)
+                cairo_prerender.transform(zoom_matrix)
+                page.render_cairo(cairo_prerender, ww, wh, wtype)
+            else:
+                # Cut out of a full page rendering, that may be shared with the other half of the page
+                pb = self.cache.render(name, nb, ww, wh)
 
             self.cache.set(name, nb, pb)
 
@@ -1167,24 +1241,7 @@ class UI(builder.Builder):
 
             cairo_context.restore()
 
-        if widget is self.c_da:
-            # do not use the zoom matrix for the pointer, it is relative to the screen not the slide
-            self.laser.render_pointer(cairo_context, ww, wh)
-
-            if self.pen_pointer[0]:
-                x = self.pen_pointer[0][0] * ww - self.pen_pointer_c.get_width() / 2
-                y = self.pen_pointer[0][1] * wh - self.pen_pointer_c.get_height() / 2
-                Gdk.cairo_set_source_pixbuf(cairo_context, self.pen_pointer_c, x, y)
-                cairo_context.paint()
-
-        elif widget is self.p_da_cur:
-            pos = self.pen_pointer[0] if self.pen_pointer[0] else \
-                  self.laser.pointer_pos if self.laser.show_pointer else None
-            if pos and self.scribbler.pen_pointer_p:
-                x = pos[0] * ww - int(self.scribbler.pen_pointer_p.get_option('x_hot'))
-                y = pos[1] * wh - int(self.scribbler.pen_pointer_p.get_option('y_hot'))
-                Gdk.cairo_set_source_pixbuf(cairo_context, self.scribbler.pen_pointer_p, x, y)
-                cairo_context.paint()
+        if widget is self.p_da_cur:
             if self.vlines > 1:
                 for i in range(1, int(self.vlines) + 1):
                     cairo_context.set_source_rgba(0.5, 0.5, 0.5, 0.5)
@@ -1208,11 +1265,97 @@ class UI(builder.Builder):
         self.cache.clear_cache(self.p_da_cur.get_name() + '_zoomed')
 
 
-    def redraw_current_slide(self):
-        """ Callback to queue a redraw of the current slides (in both winows).
+    def add_pointer_layer(self, overlay):
+        """ Add a transparent layer on top of a slide, that lets events through, to draw the pointers.
+
+        Args:
+            overlay (:class:`~Gtk.Overlay`): The overlay containing the slide
+
+        Returns:
+            :class:`~Gtk.DrawingArea`: The new layer
         """
-        self.c_da.queue_draw()
-        self.p_da_cur.queue_draw()
+        layer = Gtk.DrawingArea()
+        layer.connect('draw', self.on_draw_pointer)
+        overlay.add_overlay(layer)
+        overlay.set_overlay_pass_through(layer, True)
+        layer.show()
+
+        self.pointer_rects[layer] = []
+        return layer
+
+
+    def get_pointer_sprites(self, layer):
+        """ Get the pointer images to draw on a layer, and where to draw them.
+
+        Args:
+            layer (:class:`~Gtk.DrawingArea`): The pointer layer of either window
+
+        Returns:
+            `list` of `tuple`: The :class:`~GdkPixbuf.Pixbuf` and the coordinates of its top left corner
+        """
+        ww, wh = layer.get_allocated_width(), layer.get_allocated_height()
+        sprites = []
+
+        # do not use the zoom matrix for the pointers, they are relative to the screen not the slide
+        if layer is self.c_pointer_layer:
+            if self.blanked:
+                return sprites
+
+            laser = self.laser.get_sprite(ww, wh)
+            if laser is not None:
+                sprites.append(laser)
+
+            if self.pen_pointer[0] and self.pen_pointer_c is not None:
+                x = self.pen_pointer[0][0] * ww - self.pen_pointer_c.get_width() / 2
+                y = self.pen_pointer[0][1] * wh - self.pen_pointer_c.get_height() / 2
+                sprites.append((self.pen_pointer_c, x, y))
+
+        else:
+            pos = self.pen_pointer[0] if self.pen_pointer[0] else \
+                  self.laser.pointer_pos if self.laser.show_pointer else None
+            if pos and self.scribbler.pen_pointer_p:
+                x = pos[0] * ww - int(self.scribbler.pen_pointer_p.get_option('x_hot'))
+                y = pos[1] * wh - int(self.scribbler.pen_pointer_p.get_option('y_hot'))
+                sprites.append((self.scribbler.pen_pointer_p, x, y))
+
+        return sprites
+
+
+    def on_draw_pointer(self, layer, cairo_context):
+        """ Draw the pointers on their layer.
+
+        Args:
+            layer (:class:`~Gtk.DrawingArea`): The pointer layer of either window
+            cairo_context (:class:`~cairo.Context`): The Cairo context of the layer
+        """
+        for pixbuf, x, y in self.get_pointer_sprites(layer):
+            Gdk.cairo_set_source_pixbuf(cairo_context, pixbuf, x, y)
+            cairo_context.paint()
+        return False
+
+
+    def redraw_pointer(self):
+        """ Callback to queue a redraw of the pointers (in both windows), only where they were and where they are now.
+        """
+        if self.laser is None:
+            return
+
+        for layer, old_rects in self.pointer_rects.items():
+            rects = [(int(x) - 1, int(y) - 1, pixbuf.get_width() + 2, pixbuf.get_height() + 2)
+                     for pixbuf, x, y in self.get_pointer_sprites(layer)]
+            for rect in set(old_rects + rects):
+                layer.queue_draw_area(*rect)
+            self.pointer_rects[layer] = rects
+
+
+    def redraw_current_slide(self, reason=None, now=False):
+        """ Callback to queue a redraw of the current slides (in both winows), at their next frame.
+
+        Args:
+            reason (`str`): what changed on the slide, counted for instrumentation
+            now (`bool`): queue the redraw right away, when already running in a tick of the frame clock
+        """
+        self.redraw.request((self.c_da, self.p_da_cur), reason, now)
 
 
     ##############################################################################
@@ -1314,13 +1457,13 @@ class UI(builder.Builder):
             self.laser.toggle_pointermode()
         elif command == 'toggle_highlights':
             self.show_highlights = not self.show_highlights
-            self.redraw_current_slide()
+            self.redraw_current_slide('highlights')
         elif command == 'show_highlights':
             self.show_highlights = True
-            self.redraw_current_slide()
+            self.redraw_current_slide('highlights')
         elif command == 'hide_highlights':
             self.show_highlights = False
-            self.redraw_current_slide()
+            self.redraw_current_slide('highlights')
         elif command == "insert_blank":
             self.insert_page(self.doc.cur_page + 1)
         elif command == "page_inserted":
@@ -1645,6 +1788,7 @@ class UI(builder.Builder):
 
         self.blanked = not self.blanked
         self.c_da.queue_draw()
+        self.redraw_pointer()
         self.pres_blank.set_active(self.blanked)
 
         return True
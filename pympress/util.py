@@ -33,6 +33,8 @@ import subprocess
 import importlib
 import os
 import sys
+import time
+import collections
 
 if not getattr(sys, 'frozen', False):
     # doesn’t play too well with cx_Freeze
@@ -274,6 +276,29 @@ def get_log_path():
     return os.path.join(base_dir, 'pympress.log')
 
 
+def get_cache_dir(*path_parts):
+    """ Returns the appropriate path to a cache directory in the user app dirs, creating it if needed.
+
+    Args:
+        path_parts (`tuple` of `str`): the sub-directory of pympress' cache directory
+
+    Returns:
+        `str`: path to the cache directory.
+    """
+    if IS_WINDOWS:
+        base_dir = os.path.join(os.getenv('LOCALAPPDATA', os.getenv('APPDATA')), 'pympress')
+    elif IS_MAC_OS:
+        base_dir = os.path.expanduser('~/Library/Caches/pympress')
+    else:
+        base_dir = os.path.join(os.getenv('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'pympress')
+
+    path = os.path.join(base_dir, *path_parts)
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    return path
+
+
 def fileopen(f):
     """ Call the right function to open files, based on the platform.
 
@@ -350,6 +375,128 @@ def set_screensaver(must_disable, window):
 set_screensaver.dpms_was_enabled = None
 set_screensaver.dbus_cookie = None
 
+
+class StartupProfiler(object):
+    """ Statically record where start up time goes, and report it once the first slide is drawn.
+
+    Only active when pympress is started with ``--profile-startup``.
+    """
+    #: `list` of `tuple` of step names and times at which they ended, or `None` when not profiling
+    marks = None
+    #: :class:`~cProfile.Profile` running during start up
+    profile = None
+
+    @classmethod
+    def start(cls, start_time):
+        """ Start profiling.
+
+        Args:
+            start_time (`float`): the :func:`~time.perf_counter` value when pympress started loading
+        """
+        import cProfile
+        cls.marks = [('start', start_time), ('imports', time.perf_counter())]
+        cls.profile = cProfile.Profile()
+        cls.profile.enable()
+
+
+    @classmethod
+    def mark(cls, step):
+        """ Record the end of a start up step.
+
+        Args:
+            step (`str`): what was done since the previous mark
+        """
+        if cls.marks is not None:
+            cls.marks.append((step, time.perf_counter()))
+
+
+    @classmethod
+    def report(cls):
+        """ Stop profiling and print the durations of the steps, then the most expensive calls.
+        """
+        if cls.marks is None:
+            return
+        import pstats
+
+        cls.mark('first slide drawn')
+        cls.profile.disable()
+        marks, cls.marks = cls.marks, None
+
+        print('Start up: {:.3f}s'.format(marks[-1][1] - marks[0][1]))
+        for (prev_step, prev), (step, end) in zip(marks[:-1], marks[1:]):
+            print('  {:>8.3f}s  {}'.format(end - prev, step))
+        print()
+        pstats.Stats(cls.profile, stream=sys.stdout).sort_stats('cumulative').print_stats(25)
+
+
+class RedrawScheduler(object):
+    """ Coalesce redraw requests of widgets: mark them dirty, and queue their drawing once at the next tick of their
+    frame clock, however many requests arrived in between.
+
+    The reasons given with the requests are counted, to tell what makes the widgets redraw.
+    """
+    #: `dict` of the `set` of reasons for which each dirty widget needs redrawing, indexed by widget
+    dirty = None
+    #: `dict` of the ids of the tick callbacks flushing the dirty widgets, indexed by widget
+    ticks = None
+    #: :class:`~collections.Counter` of the redraw requests by reason
+    requests = None
+    #: :class:`~collections.Counter` of the redraws actually queued by reason
+    redraws = None
+
+    def __init__(self):
+        self.dirty = {}
+        self.ticks = {}
+        self.requests = collections.Counter()
+        self.redraws = collections.Counter()
+
+
+    def request(self, widgets, reason=None, now=False):
+        """ Mark widgets as needing a redraw.
+
+        Args:
+            widgets (`tuple` of :class:`~Gtk.Widget`): the widgets to redraw
+            reason (`str`): what changed, for instrumentation
+            now (`bool`): whether to queue the drawing right away, e.g. when already running in a tick of the frame
+                          clock, where waiting for the next tick would delay the drawing by a frame
+        """
+        self.requests[reason] += 1
+        for widget in widgets:
+            if now:
+                if widget in self.ticks:
+                    widget.remove_tick_callback(self.ticks.pop(widget))
+                self.redraws.update(self.dirty.pop(widget, set()) | {reason})
+                widget.queue_draw()
+                continue
+
+            if widget not in self.dirty:
+                self.dirty[widget] = set()
+                self.ticks[widget] = widget.add_tick_callback(self.flush)
+            self.dirty[widget].add(reason)
+
+
+    def flush(self, widget, frame_clock):
+        """ Queue drawing a dirty widget. Runs as a tick callback of the widget's frame clock.
+
+        Args:
+            widget (:class:`~Gtk.Widget`): the widget to redraw
+            frame_clock (:class:`~Gdk.FrameClock`): the frame clock of the widget
+
+        Returns:
+            `bool`: `True` iff this function should be run again at the next tick
+        """
+        self.ticks.pop(widget, None)
+        self.redraws.update(self.dirty.pop(widget, ()))
+        widget.queue_draw()
+        return False
+
+
+    def log_stats(self):
+        """ Log how many redraws were requested and queued, by reason.
+        """
+        for reason, count in self.requests.most_common():
+            logger.debug('Redraws for {}: {} requested, {} queued'.format(reason, count, self.redraws[reason]))
+
 ##
 # Local Variables:
 # mode: python